@@ -26,6 +26,7 @@ setup(
         " using Modified Pre-order Tree Traversal (MPTT) / Nested Sets"),
     long_description=read("README.rst") + "\n" + read("CHANGES.rst"),
     install_requires=read("requirements.txt"),
+    extras_require={"numpy": ["numpy"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Environment :: Console",
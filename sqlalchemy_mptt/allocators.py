@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Distributed under terms of the MIT license.
+"""
+Allocation of ``tree_id`` values for new trees
+
+The allocator of a model is taken from its ``sqlalchemy_mptt_tree_id_allocator``
+attribute. The default one, :class:`MaxTreeIdAllocator`, reads
+``MAX(tree_id) + 1`` and is not safe when several transactions create trees
+at the same time: the models whose trees are created concurrently have to
+opt in to :class:`SequenceTreeIdAllocator` or :class:`CounterTreeIdAllocator`.
+
+.. code-block:: python
+
+    from sqlalchemy import Sequence
+
+    from sqlalchemy_mptt.allocators import SequenceTreeIdAllocator
+
+
+    class Tree(Base, BaseNestedSets):
+        __tablename__ = "tree"
+
+        id = Column(Integer, primary_key=True)
+
+        sqlalchemy_mptt_tree_id_allocator = SequenceTreeIdAllocator(
+            Sequence("tree_id_seq", metadata=Base.metadata)
+        )
+"""
+# standard library
+import threading
+
+# SQLAlchemy
+from sqlalchemy import Column, Integer, String, Table
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
+
+# local
+from .sqlalchemy_compat import compat_layer
+
+
+class TreeIdAllocator(object):
+    """ Base class of the ``tree_id`` allocators.
+    """
+
+    def allocate_many(self, connection, table, count):
+        """ Return ``count`` unused tree ids in ascending order.
+        """
+        raise NotImplementedError
+
+    def allocate(self, connection, table):
+        """ Return one unused tree id.
+        """
+        return self.allocate_many(connection, table, 1)[0]
+
+    def advance(self, connection, table):
+        """ Called after the tree ids above some tree were shifted by one to
+        put a new tree in between, so the greatest tree id grew by one.
+        """
+
+
+class MaxTreeIdAllocator(TreeIdAllocator):
+    """ Next value after the greatest ``tree_id`` of the table. Default one.
+
+    It needs no extra schema, but two concurrent transactions can get the
+    same value and create two trees with the same ``tree_id``.
+    """
+
+    def allocate_many(self, connection, table, count):
+        first = connection.scalar(
+            compat_layer.select(
+                func.max(table.c.tree_id) + 1
+            )
+        ) or 1
+        return list(range(first, first + count))
+
+
+class SequenceTreeIdAllocator(TreeIdAllocator):
+    """ Takes the tree ids from a database sequence (PostgreSQL, Oracle,
+    MariaDB...), which never hands out the same value twice.
+
+    Args:
+        sequence (:class:`sqlalchemy.schema.Sequence`): sequence to use, it
+        has to start after the greatest ``tree_id`` already in the table
+
+    Kwargs:
+        block_size (int): every value of the sequence reserves this many
+        tree ids, handed out from memory before the sequence is read again;
+        the sequence has to increment by ``block_size``, e.g.
+        ``Sequence("tree_id_seq", increment=100)``. The ids left when the
+        process ends are never used.
+    """
+
+    def __init__(self, sequence, block_size=1):
+        self.sequence = sequence
+        self.block_size = block_size
+        self.reserved = []
+        self.lock = threading.Lock()
+
+    def allocate_many(self, connection, table, count):
+        select = compat_layer.select(self.sequence.next_value())
+        if self.block_size == 1:
+            return [connection.scalar(select) for _ in range(count)]
+        with self.lock:
+            while len(self.reserved) < count:
+                first = connection.scalar(select)
+                self.reserved.extend(range(first, first + self.block_size))
+            ids = self.reserved[:count]
+            del self.reserved[:count]
+        return ids
+
+    def advance(self, connection, table):
+        self.allocate(connection, table)
+
+
+class CounterTreeIdAllocator(TreeIdAllocator):
+    """ Keeps the last tree id of every tree table in a row of a counter
+    table. Incrementing the row locks it (the whole database on SQLite) until
+    the end of the transaction, so concurrent transactions never get the same
+    value. The row is created on first use, in a savepoint: the transaction
+    losing the race to create it increments the row of the other one.
+
+    Args:
+        metadata (:class:`sqlalchemy.schema.MetaData`): metadata the counter
+        table is created with
+
+    Kwargs:
+        name (str): name of the counter table
+    """
+
+    def __init__(self, metadata, name="mptt_tree_id_counter"):
+        self.table = Table(
+            name, metadata,
+            Column("tree_table", String(255), primary_key=True),
+            Column("value", Integer, nullable=False),
+            extend_existing=True
+        )
+
+    def allocate_many(self, connection, table, count):
+        counter = self.table
+        if not self._increment(connection, table, count):
+            # First tree allocated through the counter: start after the trees
+            # created without it.
+            last = MaxTreeIdAllocator().allocate(connection, table) - 1
+            try:
+                with connection.begin_nested():
+                    connection.execute(
+                        counter.insert().values(tree_table=table.name,
+                                                value=last + count)
+                    )
+            except IntegrityError:
+                # created by a concurrent transaction in the meantime
+                if not self._increment(connection, table, count):
+                    raise
+        value = connection.scalar(
+            compat_layer.select(counter.c.value)
+            .where(counter.c.tree_table == table.name)
+        )
+        return list(range(value - count + 1, value + 1))
+
+    def _increment(self, connection, table, count):
+        """ Add ``count`` to the row of ``table``, return the rows changed.
+        """
+        counter = self.table
+        return connection.execute(
+            counter.update()
+            .where(counter.c.tree_table == table.name)
+            .values(value=counter.c.value + count)
+        ).rowcount
+
+    def advance(self, connection, table):
+        self.allocate(connection, table)
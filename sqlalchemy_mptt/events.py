@@ -11,89 +11,255 @@
 SQLAlchemy events extension
 """
 # standard library
+import time
 import weakref
+from contextlib import contextmanager
 
 # SQLAlchemy
-from sqlalchemy import and_, event, inspection
+from sqlalchemy import and_, event, inspection, or_
 from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import Delete, Select, Update
 from sqlalchemy.orm.base import NO_VALUE
 
+from sqlalchemy_mptt.hooks import TreeOperation
 from sqlalchemy_mptt.sqlalchemy_compat import compat_layer
 
 
-def _insert_subtree(
-        table,
-        connection,
-        node_size,
-        node_pos_left,
-        node_pos_right,
-        parent_pos_left,
-        parent_pos_right,
-        subtree,
-        parent_tree_id,
-        parent_level,
-        node_level,
-        left_sibling,
-        table_pk
-):
-    # step 1: rebuild inserted subtree
-    delta_lft = left_sibling['lft'] + 1
-    if not left_sibling['is_parent']:
-        delta_lft = left_sibling['rgt'] + 1
-    delta_rgt = delta_lft + node_size - 1
+def _record(shifts, table, shift, tree_id, low, high=None):
+    """ Append to ``shifts`` a change made to the rows of ``table``: a
+    function of the ``(tree_id, left, right, level)`` of a row returning the
+    new values, to be replayed on the loaded nodes after the flush, with the
+    tree and the ``low``..``high`` keys it touches, for the hooks.
+    """
+    if shifts is not None:
+        shifts.append((table, shift, tree_id, (low, high)))
+
 
+def _open_gap(connection, table, tree_id, position, size, shifts=None):
+    """ Make room for ``size`` keys at ``position`` of the tree ``tree_id``:
+    every key from ``position`` on is shifted by ``size``.
+
+        UPDATE tree
+        SET left_id = CASE
+                WHEN left_id >= $position THEN left_id + $size
+                ELSE left_id
+            END,
+            right_id = CASE
+                WHEN right_id >= $position THEN right_id + $size
+                ELSE right_id
+            END
+        WHERE right_id >= $position AND tree_id = $tree_id
+    """
+    def shift(node_tree_id, left, right, level):
+        if node_tree_id == tree_id and right >= position:
+            if left >= position:
+                left += size
+            right += size
+        return node_tree_id, left, right, level
+
+    _record(shifts, table, shift, tree_id, position)
     connection.execute(
         table.update()
-        .where(table_pk.in_(subtree))
+        .where(table.c.rgt >= position)
+        .where(table.c.tree_id == tree_id)
         .values(
-            lft=table.c.lft - node_pos_left + delta_lft,
-            rgt=table.c.rgt - node_pos_right + delta_rgt,
-            level=table.c.level - node_level + parent_level + 1,
-            tree_id=parent_tree_id
+            lft=compat_layer.case(
+                (table.c.lft >= position, table.c.lft + size),
+                else_=table.c.lft
+            ),
+            rgt=compat_layer.case(
+                (table.c.rgt >= position, table.c.rgt + size),
+                else_=table.c.rgt
+            )
         )
     )
 
-    # step 2: update key of right side
+
+def _close_gap(connection, table, tree_id, lft, rgt, shifts=None):
+    """ Remove the keys from ``lft`` to ``rgt`` of the tree ``tree_id``
+
+        UPDATE tree
+        SET left_id = CASE
+                WHEN left_id > $leftId THEN left_id - $delta
+                ELSE left_id
+            END,
+            right_id = CASE
+                WHEN right_id >= $rightId THEN right_id - $delta
+                ELSE right_id
+            END
+        WHERE right_id > $rightId AND tree_id = $tree_id
+    """
+    delta = rgt - lft + 1
+
+    def shift(node_tree_id, left, right, level):
+        if node_tree_id == tree_id and right > rgt:
+            if left > lft:
+                left -= delta
+            right -= delta
+        return node_tree_id, left, right, level
+
+    _record(shifts, table, shift, tree_id, lft)
     connection.execute(
         table.update()
-        .where(table.c.rgt > delta_lft - 1)
-        .where(table_pk.notin_(subtree))
-        .where(table.c.tree_id == parent_tree_id)
+        .where(table.c.rgt > rgt)
+        .where(table.c.tree_id == tree_id)
         .values(
-            rgt=table.c.rgt + node_size,
             lft=compat_layer.case(
-                (table.c.lft > left_sibling['lft'], table.c.lft + node_size),
+                (table.c.lft > lft, table.c.lft - delta),
                 else_=table.c.lft
+            ),
+            rgt=compat_layer.case(
+                (table.c.rgt >= rgt, table.c.rgt - delta),
+                else_=table.c.rgt
             )
         )
     )
 
 
+def _move_window(left, right, position):
+    """ How the keys change when the subtree ``left``..``right`` moves to
+    ``position``: the ``delta`` of the subtree, the ``window`` of keys in
+    between and their ``shift``, and the ``low``..``high`` range touched.
+    """
+    width = right - left + 1
+    if position > right:
+        # to the right: the nodes in between go left by the subtree width
+        return (position - right - 1, (right + 1, position - 1), -width,
+                left, position - 1)
+    # to the left: the nodes in between go right by the subtree width
+    return position - left, (position, left - 1), width, position, right
+
+
+def _move_subtree(connection, table, tree_id, left, right, position,
+                  level_delta, shifts=None):
+    """ Move the subtree ``left``..``right`` of the tree ``tree_id`` to
+    ``position`` (the key right after the new left sibling or the new parent)
+    with one UPDATE, only the rows between the old and the new place are
+    touched.
+
+        UPDATE tree
+        SET level = CASE
+                WHEN left_id BETWEEN $left AND $right THEN level + $lvl
+                ELSE level
+            END,
+            left_id = CASE
+                WHEN left_id BETWEEN $left AND $right THEN left_id + $delta
+                WHEN left_id BETWEEN $low AND $high THEN left_id + $shift
+                ELSE left_id
+            END,
+            right_id = ... the same for right_id ...
+        WHERE tree_id = $tree_id
+          AND (left_id BETWEEN $low AND $high
+               OR right_id BETWEEN $low AND $high)
+
+    The level is assigned first: MySQL evaluates the assignments from left
+    to right and would see the new left_id otherwise. Raises ``ValueError``
+    when ``position`` is inside the subtree.
+    """
+    if left < position <= right:
+        raise ValueError("Can't move a node inside its own subtree")
+    if position in (left, right + 1):
+        # already there
+        return
+    delta, window, shift, low, high = _move_window(left, right, position)
+
+    def move_row(node_tree_id, node_left, node_right, level):
+        if node_tree_id != tree_id or not (low <= node_left <= high or
+                                           low <= node_right <= high):
+            return node_tree_id, node_left, node_right, level
+        if left <= node_left <= right:
+            level += level_delta
+
+        def key(value):
+            if left <= value <= right:
+                return value + delta
+            if window[0] <= value <= window[1]:
+                return value + shift
+            return value
+        return node_tree_id, key(node_left), key(node_right), level
+
+    _record(shifts, table, move_row, tree_id, low, high)
+
+    def moved(column):
+        return compat_layer.case(
+            (column.between(left, right), column + delta),
+            (column.between(*window), column + shift),
+            else_=column
+        )
+
+    connection.execute(
+        compat_layer.ordered_update(
+            table,
+            (table.c.level, compat_layer.case(
+                (table.c.lft.between(left, right), table.c.level + level_delta),
+                else_=table.c.level
+            )),
+            (table.c.lft, moved(table.c.lft)),
+            (table.c.rgt, moved(table.c.rgt))
+        )
+        .where(table.c.tree_id == tree_id)
+        .where(
+            or_(
+                table.c.lft.between(low, high),
+                table.c.rgt.between(low, high)
+            )
+        )
+    )
+
+
+def _expire_tree(session, base_class, tree_id, attrs):
+    """ Expire ``attrs`` of the loaded nodes of the tree ``tree_id``.
+
+    Only the identity map is scanned, nothing is loaded from the database;
+    nodes whose ``tree_id`` is not loaded may be in the tree and are expired
+    too.
+    """
+    for obj in list(session.identity_map.values()):
+        if not isinstance(obj, base_class):
+            continue
+        loaded = inspection.inspect(obj).dict
+        if loaded.get('tree_id', tree_id) == tree_id:
+            session.expire(obj, attrs)
+
+
+_MOVE_MARKERS = ('mptt_move_inside', 'mptt_move_before', 'mptt_move_after')
+
+
+def _has_pending_move(instance):
+    """ Whether flushing ``instance`` may move it to another place of the tree
+    """
+    for marker in _MOVE_MARKERS:
+        if hasattr(instance, marker):
+            return True
+    attrs = inspection.inspect(instance).attrs
+    return attrs.parent_id.history.has_changes() \
+        or attrs.parent.history.has_changes()
+
+
 def _get_tree_table(mapper):
     for table in mapper.tables:
         if all(key in table.c for key in ['level', 'lft', 'rgt', 'parent_id']):
             return table
 
 
-def mptt_before_insert(mapper, connection, instance):
+def mptt_before_insert(mapper, connection, instance, shifts=None):
     """ Based on example
     https://bitbucket.org/zzzeek/sqlalchemy/src/73095b353124/examples/nested_sets/nested_sets.py?at=master
     """
     table = _get_tree_table(mapper)
     db_pk = instance.get_pk_column()
     table_pk = getattr(table.c, db_pk.name)
+    gap = instance.get_gap()
 
     if instance.parent_id is None:
         instance.left = 1
-        instance.right = 2
+        instance.right = 1 + (gap or 1)
         instance.level = instance.get_default_level()
-        tree_id = connection.scalar(
-            compat_layer.select(
-                func.max(table.c.tree_id) + 1
-            )
-        ) or 1
-        instance.tree_id = tree_id
+        instance.tree_id = instance.get_tree_id_allocator().allocate(
+            connection, table
+        )
     else:
         (parent_pos_left,
          parent_pos_right,
@@ -109,30 +275,165 @@ def mptt_before_insert(mapper, connection, instance):
             )
         ).fetchone()
 
-        # Update key of right side
-        connection.execute(
-            table.update()
-            .where(table.c.rgt >= parent_pos_right)
-            .where(table.c.tree_id == parent_tree_id)
-            .values(
-                lft=compat_layer.case(
-                    (table.c.lft > parent_pos_right, table.c.lft + 2),
-                    else_=table.c.lft
-                ),
-                rgt=compat_layer.case(
-                    (table.c.rgt >= parent_pos_right, table.c.rgt + 2),
-                    else_=table.c.rgt
+        instance.level = parent_level + 1
+        instance.tree_id = parent_tree_id
+
+        if gap:
+            """ Take a free slot after the last child of the parent
+
+                SELECT MAX(right_id) FROM tree WHERE parent_id = $parent_id
+            """
+            last_pos_right = connection.scalar(
+                compat_layer.select(
+                    func.max(table.c.rgt)
+                ).where(
+                    table.c.parent_id == instance.parent_id
                 )
             )
-        )
+            if last_pos_right is None:
+                last_pos_right = parent_pos_left
+            step = min(gap, (parent_pos_right - last_pos_right) // 3)
+            if step < 1:
+                # The gap ran out: make room for a few more children at once
+                _open_gap(connection, table, parent_tree_id,
+                          parent_pos_right, 3 * gap, shifts)
+                step = gap
+            instance.left = last_pos_right + step
+            instance.right = last_pos_right + 2 * step
+            return
+
+        # Update key of right side
+        _open_gap(connection, table, parent_tree_id, parent_pos_right, 2,
+                  shifts)
 
-        instance.level = parent_level + 1
-        instance.tree_id = parent_tree_id
         instance.left = parent_pos_right
         instance.right = parent_pos_right + 1
 
 
-def mptt_before_delete(mapper, connection, instance, delete=True):
+def _group_new_nodes(instances):
+    """ Sort the new ``instances`` of a flush into the roots of new trees,
+    the children of other new nodes keyed by ``id()`` of their parent and the
+    children of existing nodes keyed by ``str()`` of the parent id. Returns
+    ``None`` when the parent of some node is neither new nor persistent.
+    """
+    members = set(id(instance) for instance in instances)
+    pending = {}
+    for instance in instances:
+        if instance.get_pk_value() is not None:
+            pending[str(instance.get_pk_value())] = instance
+
+    roots = []
+    children = {}
+    new_children = {}
+    for instance in instances:
+        parent = inspection.inspect(instance).attrs.parent.loaded_value
+        if parent is NO_VALUE or parent is None:
+            if instance.parent_id is None:
+                roots.append(instance)
+                continue
+            parent = pending.get(str(instance.parent_id))
+            parent_id = instance.parent_id
+        elif id(parent) not in members:
+            if not inspection.inspect(parent).persistent:
+                return None
+            parent, parent_id = None, parent.get_pk_value()
+        if parent is None:
+            new_children.setdefault(
+                str(parent_id), (parent_id, []))[1].append(instance)
+        else:
+            children.setdefault(id(parent), []).append(instance)
+    return roots, children, new_children
+
+
+def _select_parents(connection, table, table_pk, parent_ids):
+    """ ``(rgt, tree_id, level)`` of the existing parents, keyed by ``str()``
+    of their id, read 500 at a time.
+    """
+    positions = {}
+    for start in range(0, len(parent_ids), 500):
+        for row in connection.execute(
+            compat_layer.select(
+                table_pk,
+                table.c.rgt,
+                table.c.tree_id,
+                table.c.level
+            ).where(
+                table_pk.in_(parent_ids[start:start + 500])
+            )
+        ):
+            positions[str(row[0])] = tuple(row[1:])
+    return positions
+
+
+def _place_new_nodes(nodes, children, left, level, tree_id):
+    """ Number ``nodes`` and their new descendants in pre-order from
+    ``left``, returns the next free key.
+    """
+    path = []
+    stack = [iter(nodes)]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            if path:
+                path.pop().right = left
+                left += 1
+            continue
+        node.left = left
+        node.level = level + len(path)
+        node.tree_id = tree_id
+        left += 1
+        path.append(node)
+        stack.append(iter(children.get(id(node), ())))
+    return left
+
+
+def mptt_plan_inserts(mapper, connection, instances, shifts=None):
+    """ Assign left, right, level and tree_id to all the new ``instances`` of
+    a flush at once.
+
+    New nodes are grouped by their parent: one gap of twice the number of new
+    descendants is opened in the tree of every existing parent, new trees get
+    their tree_id from the allocator, and the positions of the nodes are
+    computed in memory. Returns the planned instances, all of them or none
+    when the parent of some node can't be found.
+    """
+    table = _get_tree_table(mapper)
+    table_pk = getattr(table.c, instances[0].get_pk_column().name)
+    groups = _group_new_nodes(instances)
+    if groups is None:
+        return []
+    roots, children, new_children = groups
+
+    positions = _select_parents(
+        connection, table, table_pk,
+        [parent_id for parent_id, _ in new_children.values()]
+    )
+    if len(positions) != len(new_children):
+        return []
+
+    if roots:
+        tree_ids = roots[0].get_tree_id_allocator().allocate_many(
+            connection, table, len(roots)
+        )
+        for root, tree_id in zip(roots, tree_ids):
+            _place_new_nodes([root], children, 1, root.get_default_level(),
+                             tree_id)
+
+    # Parents further right are shifted by the gaps opened before them.
+    shifted = {}
+    for key, (parent_pos_right, tree_id, parent_level) in sorted(
+            positions.items(), key=lambda item: item[1][:2]):
+        position = parent_pos_right + shifted.get(tree_id, 0)
+        size = _place_new_nodes(new_children[key][1], children, position,
+                                parent_level + 1, tree_id) - position
+        _open_gap(connection, table, tree_id, position, size, shifts)
+        shifted[tree_id] = shifted.get(tree_id, 0) + size
+    return instances
+
+
+def mptt_before_delete(mapper, connection, instance, delete=True,
+                       shifts=None):
     table = _get_tree_table(mapper)
     tree_id = instance.tree_id
     pk = getattr(instance, instance.get_pk_name())
@@ -146,7 +447,6 @@ def mptt_before_delete(mapper, connection, instance, delete=True):
             table_pk == pk
         )
     ).fetchone()
-    delta = rgt - lft + 1
 
     if delete:
         mapper.base_mapper.confirm_deleted_rows = False
@@ -156,52 +456,24 @@ def mptt_before_delete(mapper, connection, instance, delete=True):
             )
         )
 
+    if instance.get_gap():
+        # Sparse numbering keeps the hole for the following inserts
+        return
+
     if instance.parent_id is not None or not delete:
-        """ Update key of current tree
-
-            UPDATE tree
-            SET left_id = CASE
-                    WHEN left_id > $leftId THEN left_id - $delta
-                    ELSE left_id
-                END,
-                right_id = CASE
-                    WHEN right_id >= $rightId THEN right_id - $delta
-                    ELSE right_id
-                END
-        """
-        connection.execute(
-            table.update()
-            .where(table.c.rgt > rgt)
-            .where(table.c.tree_id == tree_id)
-            .values(
-                lft=compat_layer.case(
-                    (table.c.lft > lft, table.c.lft - delta),
-                    else_=table.c.lft
-                ),
-                rgt=compat_layer.case(
-                    (table.c.rgt >= rgt, table.c.rgt - delta),
-                    else_=table.c.rgt
-                )
-            )
-        )
+        _close_gap(connection, table, tree_id, lft, rgt, shifts)
 
 
-def mptt_before_update(mapper, connection, instance):
-    """ Based on this example:
-        http://stackoverflow.com/questions/889527/move-node-in-nested-set
+def _select_left_sibling(connection, table, table_pk, instance):
+    """ Find the node ``instance`` is moved after by ``mptt_move_before`` or
+    ``mptt_move_after`` and give the instance the parent of that node.
+
+    Returns the ``lft`` and ``rgt`` of the left sibling, or ``None``, and the
+    tree_id after which a node moved before a root goes.
     """
-    node_id = getattr(instance, instance.get_pk_name())
-    table = _get_tree_table(mapper)
-    db_pk = instance.get_pk_column()
-    default_level = instance.get_default_level()
-    table_pk = getattr(table.c, db_pk.name)
-    mptt_move_inside = None
     left_sibling = None
     left_sibling_tree_id = None
 
-    if hasattr(instance, 'mptt_move_inside'):
-        mptt_move_inside = instance.mptt_move_inside
-
     if hasattr(instance, 'mptt_move_before'):
         (
             right_sibling_left,
@@ -220,7 +492,7 @@ def mptt_before_update(mapper, connection, instance):
                 table_pk == instance.mptt_move_before
             )
         ).fetchone()
-        current_lvl_nodes = connection.execute(
+        current_lvl_node = connection.execute(
             compat_layer.select(
                 table.c.lft,
                 table.c.rgt,
@@ -232,15 +504,17 @@ def mptt_before_update(mapper, connection, instance):
                     table.c.tree_id == right_sibling_tree_id,
                     table.c.lft < right_sibling_left
                 )
-            )
-        ).fetchall()
-        if current_lvl_nodes:
+            ).order_by(
+                table.c.lft.desc()
+            ).limit(1)
+        ).fetchone()
+        if current_lvl_node:
             (
                 left_sibling_left,
                 left_sibling_right,
                 left_sibling_parent,
                 left_sibling_tree_id
-            ) = current_lvl_nodes[-1]
+            ) = current_lvl_node
             instance.parent_id = left_sibling_parent
             left_sibling = {
                 'lft': left_sibling_left,
@@ -275,25 +549,77 @@ def mptt_before_update(mapper, connection, instance):
             'is_parent': False
         }
 
-    """ Get subtree from node
+    return left_sibling, left_sibling_tree_id
 
-        SELECT id, name, level FROM my_tree
-        WHERE left_key >= $left_key AND right_key <= $right_key
-        ORDER BY left_key
+
+def _make_room_for_root(connection, table, instance, left_sibling_tree_id,
+                        shifts):
+    """ tree_id of a node becoming a root: the one following
+    ``left_sibling_tree_id``, the trees after it being renumbered, or a new
+    one from the allocator when it is ``None``.
     """
-    subtree = connection.execute(
-        compat_layer.select(table_pk)
-        .where(
-            and_(
-                table.c.lft >= instance.left,
-                table.c.rgt <= instance.right,
-                table.c.tree_id == instance.tree_id
-            )
-        ).order_by(
-            table.c.lft
+    if left_sibling_tree_id is None:
+        return instance.get_tree_id_allocator().allocate(connection, table)
+
+    def renumber(row_tree_id, left, right, level):
+        if row_tree_id is not None and row_tree_id > left_sibling_tree_id:
+            row_tree_id += 1
+        return row_tree_id, left, right, level
+
+    _record(shifts, table, renumber, None, None)
+    connection.execute(
+        table.update()
+        .where(table.c.tree_id > left_sibling_tree_id)
+        .values(
+            tree_id=table.c.tree_id + 1
         )
-    ).fetchall()
-    subtree = [x[0] for x in subtree]
+    )
+    instance.get_tree_id_allocator().advance(connection, table)
+    return left_sibling_tree_id + 1
+
+
+def _move_to_tree(connection, table, node_tree_id, node_pos_left,
+                  node_pos_right, tree_id, delta, level_delta, shifts):
+    """ Move the subtree found by its keys in the tree ``node_tree_id`` to
+    the tree ``tree_id``, ``delta`` keys and ``level_delta`` levels away.
+    """
+    def move_row(row_tree_id, left, right, level):
+        if row_tree_id == node_tree_id \
+                and node_pos_left <= left <= node_pos_right:
+            return tree_id, left + delta, right + delta, level + level_delta
+        return row_tree_id, left, right, level
+
+    _record(shifts, table, move_row, node_tree_id, node_pos_left,
+            node_pos_right)
+    connection.execute(
+        table.update()
+        .where(table.c.tree_id == node_tree_id)
+        .where(table.c.lft.between(node_pos_left, node_pos_right))
+        .values(
+            lft=table.c.lft + delta,
+            rgt=table.c.rgt + delta,
+            level=table.c.level + level_delta,
+            tree_id=tree_id
+        )
+    )
+
+
+def mptt_before_update(mapper, connection, instance, shifts=None):
+    """ Based on this example:
+        http://stackoverflow.com/questions/889527/move-node-in-nested-set
+    """
+    if not _has_pending_move(instance):
+        # only other attributes changed, nothing to do with the tree
+        return
+
+    node_id = getattr(instance, instance.get_pk_name())
+    table = _get_tree_table(mapper)
+    db_pk = instance.get_pk_column()
+    table_pk = getattr(table.c, db_pk.name)
+    mptt_move_inside = getattr(instance, 'mptt_move_inside', None)
+    left_sibling, left_sibling_tree_id = _select_left_sibling(
+        connection, table, table_pk, instance
+    )
 
     """ step 0: Initialize parameters.
 
@@ -348,87 +674,43 @@ def mptt_before_update(mapper, connection, instance):
             instance.parent_id = None
             return
 
-    # delete from old tree
-    mptt_before_delete(mapper, connection, instance, False)
+        if left_sibling:
+            position = left_sibling['rgt'] + 1
+        else:
+            position = parent_pos_left + 1
+        level_delta = parent_level + 1 - node_level
 
-    if instance.parent_id is not None:
-        """ Put there right position of new parent node (there moving node
-            should be moved)
-        """
-        (
-            parent_id,
-            parent_pos_right,
-            parent_pos_left,
-            parent_tree_id,
-            parent_level
-        ) = connection.execute(
-            compat_layer.select(
-                table_pk,
-                table.c.rgt,
-                table.c.lft,
-                table.c.tree_id,
-                table.c.level
-            ).where(
-                table_pk == instance.parent_id
+        # move inside the same tree
+        if parent_tree_id == node_tree_id:
+            _move_subtree(
+                connection, table, node_tree_id, node_pos_left,
+                node_pos_right, position, level_delta, shifts
             )
-        ).fetchone()
-        # 'size' of moving node (including all it's sub nodes)
-        node_size = node_pos_right - node_pos_left + 1
-
-        # left sibling node
-        if not left_sibling:
-            left_sibling = {
-                'lft': parent_pos_left,
-                'rgt': parent_pos_right,
-                'is_parent': True
-            }
+            return
 
-        # insert subtree in exist tree
-        instance.tree_id = parent_tree_id
-        _insert_subtree(
-            table,
-            connection,
-            node_size,
-            node_pos_left,
-            node_pos_right,
-            parent_pos_left,
-            parent_pos_right,
-            subtree,
-            parent_tree_id,
-            parent_level,
-            node_level,
-            left_sibling,
-            table_pk
-        )
+        # move to another tree: the subtree is found by its keys in the old
+        # tree
+        _open_gap(connection, table, parent_tree_id, position,
+                  node_pos_right - node_pos_left + 1, shifts)
+        tree_id = parent_tree_id
+        delta = position - node_pos_left
     else:
-        # if insert after
-        if left_sibling_tree_id or left_sibling_tree_id == 0:
-            tree_id = left_sibling_tree_id + 1
-            connection.execute(
-                table.update()
-                .where(table.c.tree_id > left_sibling_tree_id)
-                .values(
-                    tree_id=table.c.tree_id + 1
-                )
-            )
-        # if just insert
-        else:
-            tree_id = connection.scalar(
-                compat_layer.select(
-                    func.max(table.c.tree_id) + 1
-                )
-            )
+        tree_id = _make_room_for_root(connection, table, instance,
+                                      left_sibling_tree_id, shifts)
+        if left_sibling_tree_id is not None \
+                and node_tree_id > left_sibling_tree_id:
+            node_tree_id += 1
+        delta = 1 - node_pos_left
+        level_delta = instance.get_default_level() - node_level
 
-        connection.execute(
-            table.update()
-            .where(table_pk.in_(subtree))
-            .values(
-                lft=table.c.lft - node_pos_left + 1,
-                rgt=table.c.rgt - node_pos_left + 1,
-                level=table.c.level - node_level + default_level,
-                tree_id=tree_id
-            )
-        )
+    instance.tree_id = tree_id
+    _move_to_tree(connection, table, node_tree_id, node_pos_left,
+                  node_pos_right, tree_id, delta, level_delta, shifts)
+
+    # close the gap left in the old tree
+    if not instance.get_gap():
+        _close_gap(connection, table, node_tree_id, node_pos_left,
+                   node_pos_right, shifts)
 
 
 class _WeakDefaultDict(weakref.WeakKeyDictionary):
@@ -443,6 +725,77 @@ class _WeakDefaultDict(weakref.WeakKeyDictionary):
             return value
 
 
+_STATISTICS = (
+    'inserts', 'moves', 'deletes', 'selects', 'updates', 'shifted_rows',
+    'time_before_flush', 'time_before_insert', 'time_before_update',
+    'time_before_delete',
+)
+
+
+_TREE_ATTRS = ['tree_id', 'left', 'right', 'level']
+
+
+_OPERATION_KINDS = {
+    'before_flush': 'plan',
+    'before_insert': 'insert',
+    'before_update': 'move',
+    'before_delete': 'delete',
+}
+
+
+class _InstrumentedConnection(object):
+    """ Connection given to the tree handlers, counting their SELECTs, their
+    UPDATEs and the rows changed by them in every dict of ``counters`` and
+    passing every statement to the hooks of ``operation``, with the rows
+    changed by the UPDATEs and DELETEs.
+    """
+
+    def __init__(self, connection, counters, operation=None, hooks=(),
+                 shifts=None):
+        self._connection = connection
+        self._counters = counters
+        self._operation = operation
+        self._hooks = hooks
+        self._shifts = shifts
+        self._recorded = len(shifts) if shifts is not None else 0
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def execute(self, statement, *args, **kwargs):
+        if self._hooks:
+            start = time.perf_counter()
+        result = self._connection.execute(statement, *args, **kwargs)
+        rowcount = tree_id = window = None
+        if isinstance(statement, Select):
+            for counters in self._counters:
+                counters['selects'] += 1
+        elif isinstance(statement, Update):
+            rowcount = max(result.rowcount, 0)
+            for counters in self._counters:
+                counters['updates'] += 1
+                counters['shifted_rows'] += rowcount
+        elif isinstance(statement, Delete):
+            rowcount = max(result.rowcount, 0)
+        if self._hooks:
+            duration = time.perf_counter() - start
+            operation = self._operation
+            operation.statements += 1
+            operation.rowcount += rowcount or 0
+            if isinstance(statement, Update) \
+                    and len(self._shifts) > self._recorded:
+                # the shift recorded right before this UPDATE
+                self._recorded = len(self._shifts)
+                tree_id, window = self._shifts[-1][2:]
+            for hook in self._hooks:
+                hook.on_statement(operation, statement, tree_id, window,
+                                  rowcount, duration)
+        return result
+
+    def scalar(self, statement, *args, **kwargs):
+        return self.execute(statement, *args, **kwargs).scalar()
+
+
 class TreesManager(object):
     """
     Manages events dispatching for all subclasses of a given class.
@@ -451,6 +804,12 @@ class TreesManager(object):
         self.base_class = base_class
         self.classes = set()
         self.instances = _WeakDefaultDict()
+        self.planned = _WeakDefaultDict()
+        self.inserted = weakref.WeakKeyDictionary()
+        self.shifts = weakref.WeakKeyDictionary()
+        self.statistics = weakref.WeakKeyDictionary()
+        self.global_statistics = dict.fromkeys(_STATISTICS, 0)
+        self.hooks = []
 
     def register_events(self, remove=False):
         for e, h in (
@@ -502,29 +861,108 @@ class TreesManager(object):
             engine = create_engine('...')
             Session = mptt_sessionmaker(sessionmaker(bind=engine))
         """
+        event.listen(sessionmaker, 'before_flush', self.before_flush)
         event.listen(sessionmaker, 'after_flush_postexec',
                      self.after_flush_postexec)
         return sessionmaker
 
+    def before_flush(self, session, context, instances):
+        """
+        Event listener to plan the inserts of all the new nodes of the flush
+        with :func:`mptt_plan_inserts`, instead of shifting the tree once for
+        every node. Nodes moved or deleted in the same flush rely on the rows
+        inserted before them, so such flushes are left to the row by row
+        handlers, as are trees with sparse numbering. With
+        ``session.flush(objects)`` only the given ``objects`` are considered.
+        """
+        planned = self.planned[session] = weakref.WeakSet()
+        self.inserted[session] = weakref.WeakKeyDictionary()
+        self.shifts[session] = []
+        if not event.contains(self.base_class, 'before_insert',
+                              self.before_insert):
+            return
+        for new in self._new_nodes_by_table(session, instances):
+            if new[0].get_gap():
+                continue
+            new.sort(key=lambda instance: inspection.inspect(
+                instance).insert_order)
+            mapper = inspection.inspect(new[0]).mapper
+            with self._operation(session, 'before_flush',
+                                 compat_layer.connection(session, mapper),
+                                 mapper) as (connection, shifts):
+                planned.update(mptt_plan_inserts(
+                    mapper, connection, new, shifts
+                ))
+
+    def _new_nodes_by_table(self, session, instances):
+        """ New nodes of the flush grouped by tree table, none when a node is
+        moved or deleted in the same flush. With ``instances`` only these
+        objects are considered.
+        """
+        new, dirty, deleted = session.new, session.dirty, session.deleted
+        if instances is not None:
+            new, dirty, deleted = (
+                [instance for instance in instances if instance in group]
+                for group in (new, dirty, deleted)
+            )
+        for instance in deleted:
+            if isinstance(instance, self.base_class):
+                return []
+        for instance in dirty:
+            if isinstance(instance, self.base_class) \
+                    and _has_pending_move(instance):
+                return []
+
+        tables = {}
+        for instance in new:
+            if isinstance(instance, self.base_class):
+                mapper = inspection.inspect(instance).mapper
+                tables.setdefault(_get_tree_table(mapper), []).append(instance)
+        return list(tables.values())
+
     def before_insert(self, mapper, connection, instance):
         session = object_session(instance)
-        self.instances[session].add(instance)
-        mptt_before_insert(mapper, connection, instance)
+        if session not in self.shifts:
+            self.instances[session].add(instance)
+        with self._operation(session, 'before_insert', connection, mapper,
+                             instance, 'inserts') as (connection, shifts):
+            if instance not in self.planned[session]:
+                mptt_before_insert(mapper, connection, instance, shifts)
+        if session in self.shifts:
+            # the values of the node are up to date until the next shift
+            self.inserted[session][instance] = len(self.shifts[session])
 
     def before_update(self, mapper, connection, instance):
+        if not _has_pending_move(instance):
+            return
         session = object_session(instance)
         self.instances[session].add(instance)
-        mptt_before_update(mapper, connection, instance)
+        try:
+            with self._operation(session, 'before_update', connection,
+                                 mapper, instance, 'moves'
+                                 ) as (connection, shifts):
+                mptt_before_update(mapper, connection, instance, shifts)
+        finally:
+            # a move is done once, later flushes of the node must not redo it
+            for marker in _MOVE_MARKERS:
+                instance.__dict__.pop(marker, None)
 
     def before_delete(self, mapper, connection, instance):
         session = object_session(instance)
         self.instances[session].discard(instance)
-        mptt_before_delete(mapper, connection, instance)
+        with self._operation(session, 'before_delete', connection, mapper,
+                             instance, 'deletes') as (connection, shifts):
+            mptt_before_delete(mapper, connection, instance, shifts=shifts)
 
     def after_flush_postexec(self, session, context):
         """
-        Event listener to recursively expire `left` and `right` attributes the
-        parents of all modified instances part of this flush.
+        Event listener to bring the `left`, `right`, `tree_id` and `level`
+        attributes of the loaded nodes up to date after the flush: the
+        shifts applied to the table are replayed in memory on the loaded
+        values, from the insert of the node for the new ones, and set with
+        :func:`sqlalchemy.orm.attributes.set_committed_value`. The moved
+        nodes are expired. Only the identity map is scanned, nothing is
+        loaded from the database.
         """
         instances = self.instances[session]
         while True:
@@ -532,33 +970,127 @@ class TreesManager(object):
                 instance = instances.pop()
             except KeyError:
                 break
-            if instance not in session:
+            if instance in session:
+                session.expire(instance, _TREE_ATTRS)
+
+        inserted = self.inserted.pop(session, None)
+        shifts = self.shifts.pop(session, None)
+        if shifts:
+            self._replay_shifts(session, shifts, inserted)
+
+    def _replay_shifts(self, session, shifts, inserted):
+        """ Apply the ``shifts`` of the flush to the loaded nodes of
+        ``session``, from the shift following their insert for the nodes of
+        ``inserted``. Nodes with only some of the tree attributes loaded are
+        expired.
+        """
+        tables = {}
+        for obj in list(session.identity_map.values()):
+            if not isinstance(obj, self.base_class):
+                continue
+            state = inspection.inspect(obj)
+            loaded = [attr for attr in _TREE_ATTRS if attr in state.dict]
+            if not loaded:
                 continue
-            parent = self.get_parent_value(instance)
+            if len(loaded) < len(_TREE_ATTRS):
+                session.expire(obj, _TREE_ATTRS)
+                continue
+            if state.mapper not in tables:
+                tables[state.mapper] = _get_tree_table(state.mapper)
+            table = tables[state.mapper]
+            values = old = tuple(state.dict[attr] for attr in _TREE_ATTRS)
+            for shift in shifts[inserted.get(obj, 0):]:
+                if shift[0] is table:
+                    values = shift[1](*values)
+            if values != old:
+                for attr, value in zip(_TREE_ATTRS, values):
+                    set_committed_value(obj, attr, value)
+
+    def stats(self, session=None):
+        """ Statistics of the tree writes made in ``session``, or in all the
+        sessions since the last reset when it is ``None``:
+
+        * ``inserts``, ``moves``, ``deletes``: nodes handled
+        * ``selects``, ``updates``: statements issued by the tree handlers
+        * ``shifted_rows``: rows changed by these UPDATEs
+        * ``time_before_flush``, ``time_before_insert``,
+          ``time_before_update``, ``time_before_delete``: seconds spent in
+          each handler
+
+        Returns a copy, to export to a metrics system:
+
+        .. code-block:: python
+
+            from sqlalchemy_mptt import tree_manager
+
+            session.flush()
+            tree_manager.stats(session)['shifted_rows']
+        """
+        if session is None:
+            return dict(self.global_statistics)
+        return dict(self.statistics.get(session) or
+                    dict.fromkeys(_STATISTICS, 0))
+
+    def reset_stats(self, session=None):
+        """ Set the statistics of ``session``, or the global ones when it is
+        ``None``, back to zero.
+        """
+        if session is None:
+            self.global_statistics.update(dict.fromkeys(_STATISTICS, 0))
+        else:
+            self.statistics.pop(session, None)
 
-            while parent != NO_VALUE and parent is not None:
-                instances.discard(parent)
-                session.expire(parent, ['left', 'right', 'tree_id', 'level'])
-                parent = self.get_parent_value(parent)
-            else:
-                session.expire(instance, ['left', 'right', 'tree_id', 'level'])
-                self.expire_session_for_children(session, instance)
+    def add_hook(self, hook):
+        """ Call ``hook``, a :class:`sqlalchemy_mptt.hooks.TreeHook`, around
+        every tree write and for every statement issued by it.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    @contextmanager
+    def _operation(self, session, handler, connection, mapper, instance=None,
+                   count=None):
+        """ Time the ``handler`` and count the statements it issues through
+        the connection yielded, for ``session`` and globally, and call the
+        hooks. Yields the connection and the list the shifts of the handler
+        are recorded in.
+        """
+        counters = self.statistics.get(session)
+        if counters is None:
+            counters = self.statistics[session] = dict.fromkeys(_STATISTICS, 0)
+        counters = (counters, self.global_statistics)
+        if count:
+            for stats in counters:
+                stats[count] += 1
+        shifts = self.shifts.get(session)
+        hooks = list(self.hooks)
+        operation = None
+        if hooks:
+            if shifts is None:
+                # only to tell the hooks which keys are shifted
+                shifts = []
+            operation = TreeOperation(_OPERATION_KINDS[handler],
+                                      mapper.class_, instance)
+            for hook in hooks:
+                hook.on_operation_start(operation)
+        start = time.perf_counter()
+        try:
+            yield _InstrumentedConnection(
+                connection, counters, operation, hooks, shifts
+            ), shifts
+        finally:
+            elapsed = time.perf_counter() - start
+            for stats in counters:
+                stats['time_' + handler] += elapsed
+            if hooks:
+                operation.duration = elapsed
+                if instance is not None:
+                    operation.tree_id = instance.__dict__.get('tree_id')
+                for hook in hooks:
+                    hook.on_operation_end(operation)
 
     @staticmethod
     def get_parent_value(instance):
         return inspection.inspect(instance).attrs.parent.loaded_value
-
-    @staticmethod
-    def expire_session_for_children(session, instance):
-        children = instance.children
-
-        def expire_recursively(node):
-            children = node.children
-            for item in children:
-                session.expire(item, ['left', 'right', 'tree_id', 'level'])
-                expire_recursively(item)
-
-        if children != NO_VALUE and children is not None:
-            for item in children:
-                session.expire(item, ['left', 'right', 'tree_id', 'level'])
-                expire_recursively(item)
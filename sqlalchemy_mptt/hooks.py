@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Distributed under terms of the MIT license.
+"""
+Instrumentation of the tree writes
+
+Hooks added to the :class:`sqlalchemy_mptt.events.TreesManager` are called
+around every insert, move and delete of a node, and for every statement
+issued to keep the tree in order:
+
+.. code-block:: python
+
+    from sqlalchemy_mptt import tree_manager
+    from sqlalchemy_mptt.hooks import SlowOperationLogger
+
+    tree_manager.add_hook(SlowOperationLogger(threshold=0.5))
+"""
+# standard library
+import logging
+
+
+class TreeOperation(object):
+    """ A write of the tree handled by the :class:`TreesManager`.
+
+    Attributes:
+        kind (str): ``"insert"``, ``"move"``, ``"delete"`` or ``"plan"``
+        for the inserts of a whole flush planned at once
+        model (class): mapped class of the nodes
+        instance: the node, ``None`` for ``"plan"``
+        tree_id (int): tree of the node, once the operation is done
+        statements (int): statements issued
+        rowcount (int): rows changed by the UPDATEs and DELETEs
+        duration (float): seconds spent, once the operation is done
+    """
+
+    def __init__(self, kind, model, instance=None):
+        self.kind = kind
+        self.model = model
+        self.instance = instance
+        self.tree_id = None
+        self.statements = 0
+        self.rowcount = 0
+        self.duration = None
+
+
+class TreeHook(object):
+    """ Base class of the hooks, every method does nothing.
+    """
+
+    def on_operation_start(self, operation):
+        """ Called before the ``operation`` issues its first statement.
+        """
+
+    def on_operation_end(self, operation):
+        """ Called once the ``operation`` is done, even when it failed.
+        """
+
+    def on_statement(self, operation, statement, tree_id, window, rowcount,
+                     duration):
+        """ Called after every statement issued by the ``operation``.
+
+        Args:
+            statement: the SQL expression executed
+            tree_id (int): tree whose keys are shifted, ``None`` for a
+            SELECT, a DELETE or when the trees after a new one are
+            renumbered
+            window (tuple): ``(low, high)`` range of the keys shifted,
+            ``None`` for a bound it does not have, ``None`` for a SELECT or
+            a DELETE
+            rowcount (int): rows changed, ``None`` for a SELECT
+            duration (float): seconds spent
+        """
+
+
+class SlowOperationLogger(TreeHook):
+    """ Logs the operations taking ``threshold`` seconds or more.
+
+    Kwargs:
+        threshold (float): seconds
+        logger (:class:`logging.Logger`): by default ``sqlalchemy_mptt``
+        level (int): logging level of the messages
+    """
+
+    def __init__(self, threshold=1.0, logger=None, level=logging.WARNING):
+        self.threshold = threshold
+        self.logger = logger or logging.getLogger("sqlalchemy_mptt")
+        self.level = level
+
+    def on_operation_end(self, operation):
+        if operation.duration < self.threshold:
+            return
+        self.logger.log(
+            self.level,
+            "Slow %s of %s %r in tree %s: %.3fs, %d statements, "
+            "%d rows changed",
+            operation.kind, operation.model.__name__, operation.instance,
+            operation.tree_id, operation.duration, operation.statements,
+            operation.rowcount
+        )
@@ -16,15 +16,176 @@ SQLAlchemy nested sets mixin
     session = Session(bind=engine)
 
 """
+# standard library
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 # SQLAlchemy
-from sqlalchemy import Column, Integer, ForeignKey, asc, desc
+from sqlalchemy import (Column, Index, Integer, ForeignKey, String, Table,
+                        Text, and_, asc, bindparam, cast, desc, event, func,
+                        inspect, literal, or_, union_all)
 from sqlalchemy.orm import backref, relationship, object_session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.hybrid import hybrid_method
 from sqlalchemy.orm.session import Session
 from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.schema import conv, sort_tables
 
 # local
-from .events import _get_tree_table
+from .allocators import MaxTreeIdAllocator
+from .events import _close_gap, _expire_tree, _get_tree_table, _open_gap
+from .numbering import number_tree
+from .sqlalchemy_compat import compat_layer
+
+_default_allocator = MaxTreeIdAllocator()
+_default_indexes = (
+    ("tree_id", "lft"),
+    ("tree_id", "rgt"),
+    ("tree_id", "level", "lft"),
+    ("parent_id", "lft"),
+)
+# The recursive CTE of MySQL keeps the width of the first path.
+_path_type = Text().with_variant(String(65535), "mysql")\
+    .with_variant(String(65535), "mariadb")
+
+
+class _ChildrenPages(object):
+    """ Children of the nodes of the tree ``tree_id`` read in pages of
+    ``page_size`` rows, for the streaming rebuild.
+
+    The children of the node asked for are read together with the ones of
+    the nodes walked right after it, ordered by ``(parent_id, lft, pk)``.
+    A parent whose children did not fit in a page keeps a cursor and the
+    rest is read once the page is used up.
+    """
+
+    def __init__(self, connection, table, table_pk, tree_id, page_size):
+        self.connection = connection
+        self.table = table
+        self.table_pk = table_pk
+        self.tree_id = tree_id
+        self.page_size = page_size
+        self.children = {}
+        self.cursors = {}
+
+    def next_child(self, path):
+        """ Return the next child of the last node of ``path``, ``None``
+        when they are all walked.
+        """
+        pk = path[-1]
+        if pk not in self.children:
+            self._read([pk] + self._upcoming(path))
+        children = self.children[pk]
+        if not children and pk in self.cursors:
+            self._read_more(pk)
+        if children:
+            return children.popleft()
+        del self.children[pk]
+        return None
+
+    def _upcoming(self, path, levels=4):
+        """ Nodes not read yet that are walked next: the siblings still to
+        walk at the last ``levels`` levels of ``path``, or their children
+        once read.
+        """
+        upcoming = []
+        for pk in path[-2:-2 - levels:-1]:
+            for node in self.children[pk]:
+                if node in self.children:
+                    upcoming.extend(child for child in self.children[node]
+                                    if child not in self.children)
+                else:
+                    upcoming.append(node)
+                if len(upcoming) >= self.page_size - 1:
+                    return upcoming[:self.page_size - 1]
+        return upcoming
+
+    def _select(self, criteria, *order_by):
+        # not by tree_id, for the (parent_id, lft) index to be used
+        table = self.table
+        return self.connection.execute(
+            compat_layer.select(
+                table.c.parent_id, self.table_pk, table.c.lft,
+                table.c.tree_id
+            ).where(and_(criteria, table.c.lft >= 0)).order_by(
+                *order_by
+            ).limit(self.page_size)
+        ).fetchall()
+
+    def _add(self, rows):
+        for parent_id, pk, _, tree_id in rows:
+            if tree_id == self.tree_id:
+                self.children.setdefault(parent_id, deque()).append(pk)
+        if len(rows) < self.page_size:
+            return None
+        parent_id, pk, lft, _ = rows[-1]
+        self.cursors[parent_id] = (lft, pk)
+        return parent_id
+
+    def _read(self, parents):
+        table = self.table
+        rows = self._select(
+            table.c.parent_id.in_(parents),
+            compat_layer.case((table.c.parent_id == parents[0], 0), else_=1),
+            table.c.parent_id, table.c.lft, self.table_pk
+        )
+        if self._add(rows) is not None:
+            # the parents missing after the last one are unknown, but for
+            # the first one, sorted first
+            parents = parents[:1]
+        for parent_id in parents:
+            self.children.setdefault(parent_id, deque())
+
+    def _read_more(self, parent_id):
+        table = self.table
+        lft, pk = self.cursors.pop(parent_id)
+        self._add(self._select(
+            and_(
+                table.c.parent_id == parent_id,
+                or_(table.c.lft > lft,
+                    and_(table.c.lft == lft, self.table_pk > pk))
+            ),
+            table.c.lft, self.table_pk
+        ))
+
+
+def _number_nested_structure(nested_structure, forest):
+    """ Rows of the nodes of ``nested_structure`` numbered in pre-order,
+    from left 1 and level 0, and the row of the parent of every row,
+    ``None`` for the top level ones. With ``forest`` every top level node
+    starts a tree of its own and its ``tree_id`` is its position, otherwise
+    they all follow each other in tree ``0``.
+    """
+    rows = []
+    parents = []
+    left = 1
+    for number, top in enumerate(nested_structure):
+        if forest:
+            left = 1
+        else:
+            number = 0
+        path = []
+        stack = [iter([top])]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                if path:
+                    path.pop()['right'] = left
+                    left += 1
+                continue
+            row = dict(node)
+            children = row.pop('children', ())
+            row['tree_id'] = number
+            row['left'] = left
+            row['level'] = len(path)
+            left += 1
+            parents.append(path[-1] if path else None)
+            rows.append(row)
+            path.append(row)
+            stack.append(iter(children))
+    return rows, parents
 
 
 class BaseNestedSets(object):
@@ -85,6 +246,57 @@ class BaseNestedSets(object):
         """
         return getattr(cls, "sqlalchemy_mptt_default_level", 1)
 
+    @classmethod
+    def get_gap(cls):
+        """
+        Sparse numbering: number of keys a new node leaves free between its
+        neighbours, so that most inserts do not have to shift the right side
+        of the tree. Disabled (``None``) by default.
+
+        .. code-block:: python
+
+            class Tree(Base, BaseNestedSets):
+                __tablename__ = "tree"
+
+                id = Column(Integer, primary_key=True)
+
+                sqlalchemy_mptt_gap = 1024
+        """
+        return getattr(cls, "sqlalchemy_mptt_gap", None)
+
+    @classmethod
+    def get_tree_id_allocator(cls):
+        """
+        Allocator of the ``tree_id`` of new trees, see
+        :mod:`sqlalchemy_mptt.allocators`. The default one is not safe when
+        trees are created by concurrent transactions.
+        """
+        return getattr(
+            cls, "sqlalchemy_mptt_tree_id_allocator", _default_allocator
+        )
+
+    @classmethod
+    def get_indexes(cls):
+        """
+        Composite indexes created on the tree table, as tuples of column
+        names. The queries on a tree always filter on ``tree_id`` or
+        ``parent_id`` first. Set ``sqlalchemy_mptt_indexes = ()`` to create
+        none of them.
+
+        .. code-block:: python
+
+            class Tree(Base, BaseNestedSets):
+                __tablename__ = "tree"
+
+                id = Column(Integer, primary_key=True)
+
+                sqlalchemy_mptt_indexes = (
+                    ("tree_id", "lft"),
+                    ("parent_id", "lft"),
+                )
+        """
+        return getattr(cls, "sqlalchemy_mptt_indexes", _default_indexes)
+
     @classmethod
     def get_pk_name(cls):
         return getattr(cls, "sqlalchemy_mptt_pk_name", "id")
@@ -222,17 +434,14 @@ class BaseNestedSets(object):
         """  # noqa
         table = _get_tree_table(self.__mapper__)
         session = Session.object_session(self)
-        current_lvl_nodes = (
+        return (
             session.query(table)
             .filter_by(level=self.level)
             .filter_by(tree_id=self.tree_id)
             .filter(table.c.lft < self.left)
-            .order_by(table.c.lft)
-            .all()
+            .order_by(table.c.lft.desc())
+            .first()
         )
-        if current_lvl_nodes:
-            return current_lvl_nodes[-1]
-        return None
 
     @classmethod
     def _node_to_dict(cls, node, json, json_fields):
@@ -266,7 +475,67 @@ class BaseNestedSets(object):
         )
 
     @classmethod
-    def get_tree(cls, session=None, json=False, json_fields=None, query=None):
+    def _get_tree_rows(cls, session, json, json_fields, query, columns,
+                       preorder):
+        """ The nodes of :meth:`get_tree` as ``(pk, parent_id, level,
+        tree_id, left, right, dict)`` tuples.
+        """
+        nodes = cls._base_query(session)
+        if columns is not None:
+            columns = [
+                getattr(cls, column) if isinstance(column, str) else column
+                for column in columns
+            ]
+            keys = [column.key for column in columns]
+            nodes = nodes.with_entities(
+                cls.get_pk_column(), cls.parent_id, cls.level, cls.tree_id,
+                cls.left, cls.right, *columns
+            )
+
+        # handle custom query
+        if query:
+            nodes = query(nodes)
+        if preorder:
+            nodes = nodes.order_by(cls.tree_id, cls.left).all()
+        else:
+            nodes = cls._base_order(nodes).all()
+
+        if columns is not None:
+            def node_to_dict(row):
+                result = {"id": row[0]}
+                result.update(zip(keys, row[6:]))
+                return tuple(row[:6]) + (result,)
+        else:
+            def node_to_dict(node):
+                return (
+                    node.get_pk_value(), node.parent_id, node.level,
+                    node.tree_id, node.left, node.right,
+                    cls._node_to_dict(node, json, json_fields)
+                )
+        return [node_to_dict(node) for node in nodes]
+
+    @staticmethod
+    def _nest_in_preorder(nodes):
+        """ Nest the ``nodes`` sorted by ``(tree_id, left)`` with a stack of
+        their ancestors and right values.
+        """
+        tree = []
+        # the ancestors of the current node, with their tree and right
+        path = []
+        for _, _, _, tree_id, left, right, result in nodes:
+            while path and (path[-1][0] != tree_id or
+                            path[-1][1] < left):
+                path.pop()
+            if path:
+                path[-1][2].setdefault("children", []).append(result)
+            else:
+                tree.append(result)
+            path.append((tree_id, right, result))
+        return tree
+
+    @classmethod
+    def get_tree(cls, session=None, json=False, json_fields=None, query=None,
+                 columns=None, preorder=False):
         """ This method generate tree of current node table in dict or json
         format. You can make custom query with attribute ``query``. By default
         it return all nodes in table.
@@ -286,32 +555,37 @@ class BaseNestedSets(object):
                         return nodes.filter(node.__class__.tree_id.is_(node.tree_id))
 
                     node.get_tree(session=session, json=True, query=query)
+            columns (list): return the JSON format built from these columns
+            only, attribute names or column expressions, without loading the
+            nodes as ORM objects. Every node is ``{"id": pk, <column key>:
+            value...}``, e.g. ``columns=[Tree.name.label("label")]`` gives
+            the jqTree label.
+            preorder (bool): read the nodes ordered by ``(tree_id, lft)``,
+            the order of the ``(tree_id, lft)`` index, and nest them with a
+            stack of right values instead of looking up their parent. A node
+            whose parent is left out by ``query`` is put under its closest
+            ancestor kept instead of being dropped.
 
         Example:
 
         * :mod:`sqlalchemy_mptt.tests.cases.get_tree.test_get_tree`
         * :mod:`sqlalchemy_mptt.tests.cases.get_tree.test_get_json_tree`
         * :mod:`sqlalchemy_mptt.tests.cases.get_tree.test_get_json_tree_with_custom_field`
+        * :mod:`sqlalchemy_mptt.tests.cases.get_tree.test_get_json_tree_from_columns`
         """  # noqa
         tree = []
         nodes_of_level = {}
 
-        # handle custom query
-        nodes = cls._base_query(session)
-        if query:
-            nodes = query(nodes)
-        nodes = cls._base_order(nodes).all()
+        nodes = cls._get_tree_rows(session, json, json_fields, query, columns,
+                                   preorder)
+        if preorder:
+            return cls._nest_in_preorder(nodes)
 
         # search minimal level of nodes.
-        min_level = min([node.level for node in nodes] or [None])
-
-        def get_node_id(node):
-            return getattr(node, node.get_pk_name())
+        min_level = min([node[2] for node in nodes] or [None])
 
-        for node in nodes:
-            result = cls._node_to_dict(node, json, json_fields)
-            parent_id = node.parent_id
-            if node.level != min_level:  # for children
+        for node_id, parent_id, level, _, _, _, result in nodes:
+            if level != min_level:  # for children
                 # Find parent in the tree
                 if parent_id not in nodes_of_level.keys():
                     continue
@@ -320,12 +594,52 @@ class BaseNestedSets(object):
                 # Append node to parent
                 nl = nodes_of_level[parent_id]["children"]
                 nl.append(result)
-                nodes_of_level[get_node_id(node)] = nl[-1]
+                nodes_of_level[node_id] = nl[-1]
             else:  # for top level nodes
                 tree.append(result)
-                nodes_of_level[get_node_id(node)] = tree[-1]
+                nodes_of_level[node_id] = tree[-1]
         return tree
 
+    @classmethod
+    def iter_tree(cls, session=None, query=None, yield_per=1000):
+        """ Walk the trees of the table depth first without building them:
+        yields ``("enter", node)`` when a node is reached and
+        ``("leave", node)`` once all its descendants were yielded.
+
+        The nodes are streamed ordered by ``(tree_id, lft)`` and only the
+        path from the root to the current node is kept, so the memory does
+        not depend on the size of the trees. The depth of a node is its
+        ``level``.
+
+        Args:
+            session (:mod:`sqlalchemy.orm.session.Session`): SQLAlchemy session
+
+        Kwargs:
+            query (function): it takes :class:`sqlalchemy.orm.query.Query`
+            object as an argument, and returns in a modified form, as in
+            :meth:`get_tree`. A node is yielded inside the closest of its
+            ancestors kept by the query.
+            yield_per (int): number of rows fetched at once
+
+        Example:
+
+        * :mod:`sqlalchemy_mptt.tests.cases.get_tree.test_iter_tree`
+        """
+        nodes = cls._base_query(session)
+        if query:
+            nodes = query(nodes)
+        nodes = nodes.order_by(cls.tree_id, cls.left).yield_per(yield_per)
+
+        path = []
+        for node in nodes:
+            while path and (path[-1].tree_id != node.tree_id or
+                            path[-1].right < node.left):
+                yield "leave", path.pop()
+            yield "enter", node
+            path.append(node)
+        while path:
+            yield "leave", path.pop()
+
     def _drilldown_query(self, nodes=None):
         table = self.__class__
         if not nodes:
@@ -478,60 +792,566 @@ class BaseNestedSets(object):
         query = query.filter(table.parent_id == self.get_pk_value())
         return query
 
+    def get_previous_sibling(self, session=None):
+        r"""
+        * https://django-mptt.readthedocs.io/en/latest/models.html#get-previous-sibling
+
+        Returns the sibling right before this model instance, or ``None``.
+        Root nodes are considered to be siblings of other root nodes.
+
+        For example:
+
+            .. testcode::
+
+                node10.get_previous_sibling() #-> Node(8)
+
+            .. code::
+
+                level           Nested sets example
+
+                1                   1(1)22
+                        ______________|____________________
+                       |              |                    |
+                       |              |                    |
+                2    2(2)5          6(4)11              12(7)21
+                       |              ^                /       \            |
+                3    3(3)4      7(5)8   9(6)10        /         \           |
+                                                   13(8)16   17(10)20       |
+                                                      |         |           |
+                4                                  14(9)15   18(11)19       |
+
+
+        """
+        table = self.__class__
+        query = self._base_query_obj(session=session)
+        if self.parent_id is None:
+            query = query.filter(table.parent_id.is_(None))\
+                .filter(table.tree_id < self.tree_id)\
+                .order_by(table.tree_id.desc())
+        else:
+            query = query.filter(table.tree_id == self.tree_id)\
+                .filter(table.parent_id == self.parent_id)\
+                .filter(table.right < self.left)\
+                .order_by(table.right.desc())
+        return query.first()
+
+    def get_next_sibling(self, session=None):
+        r"""
+        * https://django-mptt.readthedocs.io/en/latest/models.html#get-next-sibling
+
+        Returns the sibling right after this model instance, or ``None``.
+        Root nodes are considered to be siblings of other root nodes.
+
+        For example:
+
+            .. testcode::
+
+                node8.get_next_sibling() #-> Node(10)
+
+            .. code::
+
+                level           Nested sets example
+
+                1                   1(1)22
+                        ______________|____________________
+                       |              |                    |
+                       |              |                    |
+                2    2(2)5          6(4)11              12(7)21
+                       |              ^                /       \            |
+                3    3(3)4      7(5)8   9(6)10        /         \           |
+                                                   13(8)16   17(10)20       |
+                                                      |         |           |
+                4                                  14(9)15   18(11)19       |
+
+
+        """
+        table = self.__class__
+        query = self._base_query_obj(session=session)
+        if self.parent_id is None:
+            query = query.filter(table.parent_id.is_(None))\
+                .filter(table.tree_id > self.tree_id)\
+                .order_by(table.tree_id)
+        else:
+            query = query.filter(table.tree_id == self.tree_id)\
+                .filter(table.parent_id == self.parent_id)\
+                .filter(table.left > self.right)\
+                .order_by(table.left)
+        return query.first()
+
+    def load_subtree(self, session=None):
+        r"""
+        Load all the descendants of the node with one query on its left and
+        right values and fill their ``children`` and ``parent`` relationships
+        as already loaded, so walking the branch from the node needs no more
+        query. The loaded state of these relationships is replaced.
+
+        Returns the descendants in tree order.
+
+        For example:
+
+            .. testcode::
+
+                node7.load_subtree() #-> [Node(8), Node(9), Node(10), Node(11)]
+                node7.children[1].children #-> [Node(11)], no query
+
+        Example in tests:
+
+            * :mod:`sqlalchemy_mptt.tests.cases.get_node.test_load_subtree`
+        """
+        table = self.__class__
+        query = self._base_query_obj(session=session)
+        descendants = (
+            query.filter(self.is_ancestor_of(table))
+            .order_by(table.left)
+            .all()
+        )
+
+        nodes = {self.get_pk_value(): self}
+        children = {self.get_pk_value(): []}
+        for node in descendants:
+            pk = node.get_pk_value()
+            nodes[pk] = node
+            children[pk] = []
+            children.setdefault(node.parent_id, []).append(node)
+        for pk, node in nodes.items():
+            set_committed_value(node, "children", children[pk])
+            if node is not self:
+                set_committed_value(node, "parent", nodes.get(node.parent_id))
+        return descendants
+
     @classmethod
-    def rebuild_tree(cls, session, tree_id):
-        """ This method rebuild tree.
+    def bulk_insert_tree(cls, session, nested_structure, parent=None):
+        """ Insert a whole structure of new nodes at once.
+
+        The left, right, level and tree_id values of every node are computed
+        in memory, a single gap is opened in the target tree and all rows are
+        written with one ``executemany``, so the cost does not depend on the
+        number of inserted nodes. MPTT events are not fired for these rows.
 
         Args:
             session (:mod:`sqlalchemy.orm.session.Session`): SQLAlchemy session
-            tree_id (int or str): id of tree
+            nested_structure (list): dicts with the column values of the new
+                nodes, the nested nodes are listed under the ``children`` key
+
+        Kwargs:
+            parent (node): nodes are appended as the last children of
+            ``parent``; by default every top level dict becomes a new tree
+
+            .. testcode::
+
+                Tree.bulk_insert_tree(
+                    session,
+                    [{'visible': True, 'children': [{}, {'visible': False}]}],
+                    parent=node8,
+                )
 
         Example:
 
-        * :mod:`sqlalchemy_mptt.tests.cases.get_tree.test_rebuild`
+        * :mod:`sqlalchemy_mptt.tests.cases.edit_node.test_bulk_insert_tree`
         """
-        session.query(cls).filter_by(tree_id=tree_id).update(
-            {cls.left: 0, cls.right: 0, cls.level: 0}
+        table = _get_tree_table(cls.__mapper__)
+        pk_name = cls.get_pk_name()
+        table_pk = getattr(table.c, cls.get_pk_column().name)
+        session.flush()
+
+        rows, parents = _number_nested_structure(
+            nested_structure, forest=parent is None
+        )
+        if not rows:
+            return
+
+        if parent is None:
+            parent_id = None
+            tree_ids = cls.get_tree_id_allocator().allocate_many(
+                session.connection(), table, len(nested_structure)
+            )
+            offset = 0
+            level = cls.get_default_level()
+            window = table.c.tree_id.in_(tree_ids)
+        else:
+            parent_id = parent.get_pk_value()
+            (parent_pos_right,
+             tree_id,
+             parent_level) = session.execute(
+                compat_layer.select(
+                    table.c.rgt,
+                    table.c.tree_id,
+                    table.c.level
+                ).where(
+                    table_pk == parent_id
+                )
+            ).fetchone()
+            size = 2 * len(rows)
+            _open_gap(
+                session.connection(), table, tree_id, parent_pos_right, size
+            )
+            _expire_tree(
+                session, cls, tree_id, ['left', 'right', 'children']
+            )
+            tree_ids = [tree_id]
+            offset = parent_pos_right - 1
+            level = parent_level + 1
+            window = and_(
+                table.c.tree_id == tree_id,
+                table.c.lft.between(parent_pos_right,
+                                    parent_pos_right + size - 1)
+            )
+
+        orphans = False
+        for row, row_parent in zip(rows, parents):
+            row['tree_id'] = tree_ids[row['tree_id']]
+            row['left'] += offset
+            row['right'] += offset
+            row['level'] += level
+            if row_parent is None:
+                row['parent_id'] = parent_id
+            else:
+                row['parent_id'] = row_parent.get(pk_name)
+                orphans = orphans or row['parent_id'] is None
+        # The tables of a joined inheritance only share a primary key
+        # generated by the database when it is fetched back row by row.
+        session.bulk_insert_mappings(
+            cls, rows,
+            return_defaults=len(cls.__mapper__.tables) > 1 and any(
+                row.get(pk_name) is None for row in rows
+            )
+        )
+
+        if orphans:
+            # Primary keys were generated by the database: look them up by
+            # their position to link the children to their parents.
+            pks = dict(
+                ((tree_id, lft), pk) for pk, tree_id, lft in session.execute(
+                    compat_layer.select(table_pk, table.c.tree_id, table.c.lft)
+                    .where(window)
+                )
+            )
+            session.bulk_update_mappings(cls, [
+                {
+                    pk_name: pks[row['tree_id'], row['left']],
+                    'parent_id': pks[row_parent['tree_id'],
+                                     row_parent['left']]
+                }
+                for row, row_parent in zip(rows, parents)
+                if row_parent is not None and row['parent_id'] is None
+            ])
+
+    def delete_subtree(self, session=None):
+        """ Delete the node with all its descendants.
+
+        Unlike ``session.delete(node)``, which loads every descendant through
+        the ``children`` cascade and fires the MPTT events for each of them,
+        the whole branch is removed with one range ``DELETE`` and the gap is
+        closed with a single ``UPDATE``. Loaded descendants are expunged from
+        the session, the others are never loaded.
+
+        Kwargs:
+            session (:mod:`sqlalchemy.orm.session.Session`): SQLAlchemy session
+
+        Example:
+
+        * :mod:`sqlalchemy_mptt.tests.cases.edit_node.test_delete_subtree`
+        """
+        session = session or object_session(self)
+        session.flush()
+        cls = self.__class__
+        table = _get_tree_table(cls.__mapper__)
+        table_pk = getattr(table.c, self.get_pk_column().name)
+        connection = compat_layer.connection(session, cls.__mapper__)
+        lft, rgt, tree_id = connection.execute(
+            compat_layer.select(
+                table.c.lft,
+                table.c.rgt,
+                table.c.tree_id
+            ).where(
+                table_pk == self.get_pk_value()
+            )
+        ).fetchone()
+        subtree = and_(
+            table.c.tree_id == tree_id,
+            table.c.lft.between(lft, rgt)
+        )
+        pks = [
+            row[0] for row in connection.execute(
+                compat_layer.select(table_pk).where(subtree)
+            )
+        ]
+
+        tables = []
+        for mapper in cls.__mapper__.base_mapper.self_and_descendants:
+            tables.extend(t for t in mapper.tables if t not in tables)
+        if tables == [table]:
+            connection.execute(table.delete().where(subtree))
+        else:
+            # Joined inheritance: the rows of the other tables share the
+            # primary key, remove the dependent rows first.
+            for other in reversed(sort_tables(tables)):
+                other_pk = list(other.primary_key)[0]
+                for start in range(0, len(pks), 500):
+                    connection.execute(other.delete().where(
+                        other_pk.in_(pks[start:start + 500])
+                    ))
+        if not self.get_gap():
+            _close_gap(connection, table, tree_id, lft, rgt)
+
+        # Forget the deleted nodes without loading them, whatever their
+        # loaded attributes. Expunging a node cascades to its loaded
+        # children, which may be gone from the session already.
+        deleted = set(pks)
+        base_class = cls.__mapper__.base_mapper.class_
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, base_class) and obj in session \
+                    and inspect(obj).identity[0] in deleted:
+                session.expunge(obj)
+        if self in session:
+            session.expunge(self)
+
+        _expire_tree(
+            session, base_class, tree_id, ['left', 'right', 'children']
+        )
+
+    def rebuild_subtree(self, session=None):
+        """ Renumber the descendants of the node from their ``parent_id``.
+
+        The node keeps its left and level values, the descendants found
+        through ``parent_id`` are numbered after it and the rest of the tree
+        is shifted only if the size of the subtree changed. The cost depends
+        on the size of the subtree, not of the tree.
+
+        Kwargs:
+            session (:mod:`sqlalchemy.orm.session.Session`): SQLAlchemy session
+
+        Raises:
+            ValueError: the node is a descendant of itself by ``parent_id``
+
+        Example:
+
+        * :mod:`sqlalchemy_mptt.tests.cases.edit_node.test_rebuild_subtree`
+        """
+        session = session or object_session(self)
+        session.flush()
+        cls = self.__class__
+        table = _get_tree_table(cls.__mapper__)
+        table_pk = getattr(table.c, self.get_pk_column().name)
+        connection = compat_layer.connection(session, cls.__mapper__)
+        pk = self.get_pk_value()
+        lft, rgt, level, tree_id = connection.execute(
+            compat_layer.select(
+                table.c.lft,
+                table.c.rgt,
+                table.c.level,
+                table.c.tree_id
+            ).where(
+                table_pk == pk
+            )
+        ).fetchone()
+
+        # the descendants by parent_id, the keys may be broken; UNION stops
+        # on the rows seen before when parent_id has a cycle
+        subtree = compat_layer.select(
+            table_pk.label("pk"),
+            table.c.parent_id,
+            table.c.lft
+        ).where(
+            table_pk == pk
+        ).cte("mptt_subtree", recursive=True)
+        child = table.alias("mptt_child")
+        subtree = subtree.union(
+            compat_layer.select(
+                getattr(child.c, table_pk.name),
+                child.c.parent_id,
+                child.c.lft
+            ).where(
+                child.c.parent_id == subtree.c.pk
+            )
         )
-        top = (
-            session.query(cls)
-            .filter_by(parent_id=None)
-            .filter_by(tree_id=tree_id)
-            .one()
+        ids = []
+        parent_ids = []
+        for node_pk, parent_id, _ in connection.execute(
+                compat_layer.select(
+                    subtree.c.pk, subtree.c.parent_id, subtree.c.lft
+                ).order_by(subtree.c.lft, subtree.c.pk)):
+            ids.append(node_pk)
+            if node_pk == pk:
+                # the parent of the subtree is not renumbered
+                node_parent_id, parent_id = parent_id, None
+            parent_ids.append(parent_id)
+        if node_parent_id in ids:
+            raise ValueError("Node %r is a descendant of itself" % (pk,))
+        lefts, rights, levels = number_tree(
+            ids, parent_ids, left=lft, level=level
         )
-        top.left = left = 1
-        top.right = right = 2
-        top.level = level = cls.get_default_level()
 
-        def recursive(children, left, right, level):
-            level = level + 1
-            for i, node in enumerate(children):
-                same_level_right = children[i - 1].right
-                left = left + 1
+        size = rights[ids.index(pk)] - rgt
+        if size:
+            _open_gap(connection, table, tree_id, rgt + 1, size)
+        update = table.update().where(
+            table_pk == bindparam("_pk")
+        ).values(
+            lft=bindparam("_lft"),
+            rgt=bindparam("_rgt"),
+            level=bindparam("_level"),
+            tree_id=tree_id,
+        )
+        values = [
+            {"_pk": node_pk, "_lft": node_lft, "_rgt": node_rgt,
+             "_level": node_level}
+            for node_pk, node_lft, node_rgt, node_level
+            in zip(ids, lefts, rights, levels)
+        ]
+        for start in range(0, len(values), 10000):
+            connection.execute(update, values[start:start + 10000])
+        _expire_tree(
+            session, cls.__mapper__.base_mapper.class_, tree_id,
+            ["left", "right", "level"]
+        )
 
-                if i > 0:
-                    left = left + 1
-                if same_level_right:
-                    left = same_level_right + 1
+    @classmethod
+    def rebuild_tree(cls, session, tree_id, streaming=False,
+                     batch_size=10000):
+        """ This method rebuild tree.
 
-                right = left + 1
-                node.left = left
-                node.right = right
-                parent = node.parent
+        The ``parent_id`` of all the nodes of the tree are read with one
+        query, the new left, right and level values are computed in memory
+        by :func:`sqlalchemy_mptt.numbering.number_tree` and written back
+        with ``executemany``. Siblings keep the order of their current left
+        value.
 
-                j = 0
-                while parent:
-                    parent.right = right + 1 + j
-                    parent = parent.parent
-                    j += 1
+        Args:
+            session (:mod:`sqlalchemy.orm.session.Session`): SQLAlchemy session
+            tree_id (int or str): id of tree
+
+        Kwargs:
+            streaming (bool): walk the tree from the database instead of
+            loading it, only the current path is kept in memory (see
+            :meth:`_rebuild_streaming`)
+            batch_size (int): number of rows written by one ``executemany``
+
+        Raises:
+            ValueError: the parent of some node is not in the tree
+
+        Example:
+
+        * :mod:`sqlalchemy_mptt.tests.cases.get_tree.test_rebuild`
+        """
+        if streaming:
+            cls._rebuild_streaming(session, tree_id, batch_size)
+            return
+        session.flush()
+        table = _get_tree_table(cls.__mapper__)
+        table_pk = getattr(table.c, cls.get_pk_column().name)
+        connection = compat_layer.connection(session, cls.__mapper__)
+
+        ids = []
+        parent_ids = []
+        rows = connection.execute(
+            compat_layer.select(table_pk, table.c.parent_id)
+            .where(table.c.tree_id == tree_id)
+            .order_by(table.c.lft, table_pk)
+            .execution_options(stream_results=True)
+        )
+        for pk, parent_id in rows:
+            ids.append(pk)
+            parent_ids.append(parent_id)
+        lefts, rights, levels = number_tree(
+            ids, parent_ids, level=cls.get_default_level()
+        )
+        values = [
+            {"_pk": pk, "_lft": lft, "_rgt": rgt, "_level": node_level}
+            for pk, lft, rgt, node_level in zip(ids, lefts, rights, levels)
+        ]
+
+        update = table.update().where(
+            table_pk == bindparam("_pk")
+        ).values(
+            lft=bindparam("_lft"),
+            rgt=bindparam("_rgt"),
+            level=bindparam("_level"),
+        )
+        for start in range(0, len(values), batch_size):
+            connection.execute(update, values[start:start + batch_size])
+        _expire_tree(
+            session, cls.__mapper__.base_mapper.class_, tree_id,
+            ["left", "right", "level"]
+        )
 
-                node.level = level
-                recursive(node.children, left, right, level)
+    @classmethod
+    def _rebuild_streaming(cls, session, tree_id, batch_size):
+        """ Depth first walk of the tree from the database, the children of
+        the nodes are read in pages of at most ``batch_size`` (and 500) rows
+        by :class:`_ChildrenPages`, one page holding the children of the
+        node walked and of the ones walked after it. Memory holds the
+        current path, the pages not walked yet and one batch of pending
+        updates, whatever the size of the tree.
+
+        The new keys are written negated, so the rows already written are
+        told apart from the ones still to walk, and are made positive with
+        one last ``UPDATE``. Negative keys found in the tree are set to 0
+        first.
+        """
+        session.flush()
+        table = _get_tree_table(cls.__mapper__)
+        table_pk = getattr(table.c, cls.get_pk_column().name)
+        connection = compat_layer.connection(session, cls.__mapper__)
+        pages = _ChildrenPages(connection, table, table_pk, tree_id,
+                               min(batch_size, 500))
+
+        update = table.update().where(
+            table_pk == bindparam("_pk")
+        ).values(
+            lft=bindparam("_lft"),
+            rgt=bindparam("_rgt"),
+            level=bindparam("_level"),
+        )
+        values = []
+        connection.execute(
+            table.update().where(
+                and_(table.c.tree_id == tree_id, table.c.lft < 0)
+            ).values(lft=0)
+        )
 
-        recursive(top.children, left, right, level)
+        def write(pk, lft, rgt, level):
+            values.append(
+                {"_pk": pk, "_lft": -lft, "_rgt": -rgt, "_level": level}
+            )
+            if len(values) >= batch_size:
+                connection.execute(update, values)
+                del values[:]
+
+        roots = connection.execute(
+            compat_layer.select(table_pk).where(
+                and_(table.c.tree_id == tree_id, table.c.parent_id.is_(None))
+            ).order_by(table.c.lft, table_pk)
+        ).fetchall()
+        for root, in roots:
+            path = [root]
+            # left and level of the nodes of the path
+            keys = [(1, cls.get_default_level())]
+            position = 2
+            while path:
+                child = pages.next_child(path)
+                if child is None:
+                    lft, level = keys.pop()
+                    write(path.pop(), lft, position, level)
+                else:
+                    path.append(child)
+                    keys.append((position, keys[-1][1] + 1))
+                position += 1
+        if values:
+            connection.execute(update, values)
+        connection.execute(
+            table.update().where(
+                and_(table.c.tree_id == tree_id, table.c.lft < 0)
+            ).values(lft=-table.c.lft, rgt=-table.c.rgt)
+        )
+        _expire_tree(
+            session, cls.__mapper__.base_mapper.class_, tree_id,
+            ["left", "right", "level"]
+        )
 
     @classmethod
-    def rebuild(cls, session, tree_id=None):
+    def rebuild(cls, session, tree_id=None, server_side=False, workers=None,
+                engine=None, streaming=False, batch_size=10000):
         """ This function rebuild tree.
 
         Args:
@@ -539,14 +1359,300 @@ class BaseNestedSets(object):
 
         Kwargs:
             tree_id (int or str): id of tree, default None
+            server_side (bool): compute the tree in the database with a
+            recursive CTE and apply it with a single ``UPDATE ... FROM``,
+            no row is read by Python. Needs ``WITH RECURSIVE``, window
+            functions and ``UPDATE ... FROM`` (PostgreSQL, MySQL 8,
+            SQLite 3.33+ with SQLAlchemy 2.0+) and SQLAlchemy 1.4+, the
+            trees are rebuilt by Python elsewhere.
+            workers (int): rebuild the trees in a pool of this many threads,
+            each tree in its own session and transaction on ``engine``
+            (by default the bind of ``session``). Only committed rows are
+            seen by the workers. Returns the seconds taken by every tree,
+            by ``tree_id``.
+            engine (:class:`sqlalchemy.engine.Engine`): engine of the workers
+            streaming (bool): walk every tree from the database with a
+            memory bounded by its depth and ``batch_size``, for the tables
+            too big to be loaded
+            batch_size (int): number of rows written by one ``executemany``
 
         Example:
 
         * :mod:`sqlalchemy_mptt.tests.TestTree.test_rebuild`
         """
+        if server_side and compat_layer.supports_update_from(
+                session.get_bind(mapper=cls.__mapper__).dialect):
+            cls._rebuild_server_side(session, tree_id)
+            return
 
-        trees = session.query(cls).filter_by(parent_id=None)
         if tree_id:
-            trees = trees.filter_by(tree_id=tree_id)
-        for tree in trees:
-            cls.rebuild_tree(session, tree.tree_id)
+            tree_ids = [tree_id]
+        else:
+            table = _get_tree_table(cls.__mapper__)
+            connection = compat_layer.connection(session, cls.__mapper__)
+            tree_ids = [
+                row[0] for row in connection.execute(
+                    compat_layer.select(table.c.tree_id)
+                    .where(table.c.parent_id.is_(None))
+                    .order_by(table.c.tree_id)
+                )
+            ]
+        if workers:
+            return cls._rebuild_in_pool(
+                session, tree_ids, workers,
+                engine or session.get_bind(mapper=cls.__mapper__),
+                streaming, batch_size
+            )
+        for tree_id in tree_ids:
+            cls.rebuild_tree(session, tree_id, streaming, batch_size)
+
+    @classmethod
+    def initialize_from_adjacency(cls, session, batch_size=10000):
+        """ Fill the ``tree_id``, left, right and level columns of a table
+        only known by its ``parent_id`` values, e.g. a legacy adjacency list
+        migrated to :class:`BaseNestedSets`.
+
+        Every node without parent (or whose parent does not exist) becomes
+        the root of a tree, with a ``tree_id`` given by the allocator of the
+        model in the order of the primary keys. The ``(pk, parent_id)``
+        pairs are read with one query, numbered by
+        :func:`sqlalchemy_mptt.numbering.number_tree`, siblings by primary
+        key, and written with one ``executemany`` per ``batch_size`` rows.
+
+        Args:
+            session (:mod:`sqlalchemy.orm.session.Session`): SQLAlchemy session
+
+        Kwargs:
+            batch_size (int): number of rows written by one ``executemany``
+
+        Raises:
+            ValueError: the parents of some nodes form a cycle
+
+        Example:
+
+        * :mod:`sqlalchemy_mptt.tests.cases.edit_node.test_initialize_from_adjacency`
+        """  # noqa
+        session.flush()
+        table = _get_tree_table(cls.__mapper__)
+        table_pk = getattr(table.c, cls.get_pk_column().name)
+        connection = compat_layer.connection(session, cls.__mapper__)
+
+        ids = []
+        parent_ids = []
+        rows = connection.execute(
+            compat_layer.select(table_pk, table.c.parent_id)
+            .order_by(table_pk)
+            .execution_options(stream_results=True)
+        )
+        for pk, parent_id in rows:
+            ids.append(pk)
+            parent_ids.append(parent_id)
+        # dangling parents, with no foreign key to keep them
+        known = set(ids)
+        parent_ids = [
+            parent_id if parent_id in known else None
+            for parent_id in parent_ids
+        ]
+        root_level = cls.get_default_level()
+        lefts, rights, levels = number_tree(ids, parent_ids, level=root_level)
+
+        # the tree of every node is the one of its parent, roots first
+        index = dict((pk, i) for i, pk in enumerate(ids))
+        by_level = sorted(range(len(ids)), key=levels.__getitem__)
+        roots = levels.count(root_level)
+        tree_ids = [None] * len(ids)
+        new_tree_ids = iter(
+            cls.get_tree_id_allocator().allocate_many(
+                connection, table, roots
+            ) if roots else ()
+        )
+        for i in by_level:
+            if levels[i] == root_level:
+                tree_ids[i] = next(new_tree_ids)
+            else:
+                tree_ids[i] = tree_ids[index[parent_ids[i]]]
+
+        update = table.update().where(
+            table_pk == bindparam("_pk")
+        ).values(
+            lft=bindparam("_lft"),
+            rgt=bindparam("_rgt"),
+            level=bindparam("_level"),
+            tree_id=bindparam("_tree_id"),
+        )
+        values = [
+            {"_pk": pk, "_lft": lft, "_rgt": rgt, "_level": node_level,
+             "_tree_id": tree_id}
+            for pk, lft, rgt, node_level, tree_id
+            in zip(ids, lefts, rights, levels, tree_ids)
+        ]
+        for start in range(0, len(values), batch_size):
+            connection.execute(update, values[start:start + batch_size])
+
+        base_class = cls.__mapper__.base_mapper.class_
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, base_class):
+                session.expire(obj, ["tree_id", "left", "right", "level"])
+
+    @classmethod
+    def _rebuild_in_pool(cls, session, tree_ids, workers, engine,
+                         streaming=False, batch_size=10000):
+        """ Trees share no rows, each of them is rebuilt by a worker of the
+        pool in a session of its own.
+        """
+        def rebuild_tree(tree_id):
+            start = time.time()
+            worker_session = Session(bind=engine)
+            try:
+                cls.rebuild_tree(
+                    worker_session, tree_id, streaming, batch_size
+                )
+                worker_session.commit()
+            finally:
+                worker_session.close()
+            return tree_id, time.time() - start
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            timings = dict(pool.map(rebuild_tree, tree_ids))
+        base_class = cls.__mapper__.base_mapper.class_
+        for tree_id in tree_ids:
+            _expire_tree(
+                session, base_class, tree_id, ["left", "right", "level"]
+            )
+        return timings
+
+    @classmethod
+    def _rebuild_server_side(cls, session, tree_id=None):
+        """ Every node gets a path made of the fixed width ranks of itself and
+        its ancestors among their siblings. Sorting the paths, and the paths
+        followed by ``z`` for the moments the nodes are left, gives the left
+        and right values as positions.
+
+            WITH RECURSIVE ranked AS (
+                SELECT id, parent_id, tree_id,
+                       CAST(1000000000 + ROW_NUMBER() OVER (
+                           PARTITION BY tree_id ORDER BY left_id, id
+                       ) AS TEXT) AS rank
+                FROM tree
+            ),
+            paths AS (
+                SELECT id, tree_id, 0 AS depth, CAST(rank AS TEXT) AS path
+                FROM ranked WHERE parent_id IS NULL
+                UNION ALL
+                SELECT ranked.id, ranked.tree_id, depth + 1, path || rank
+                FROM paths JOIN ranked ON ranked.parent_id = paths.id
+            ),
+            positions AS (
+                SELECT id, depth, ROW_NUMBER() OVER (
+                    PARTITION BY tree_id ORDER BY key
+                ) AS position
+                FROM (SELECT id, tree_id, depth, path AS key FROM paths
+                      UNION ALL
+                      SELECT id, tree_id, depth, path || 'z' FROM paths)
+            ),
+            numbered AS (
+                SELECT id, MIN(position) AS left_id,
+                       MAX(position) AS right_id, MAX(depth) AS depth
+                FROM positions GROUP BY id
+            )
+            UPDATE tree SET left_id = numbered.left_id, ...
+            FROM numbered WHERE tree.id = numbered.id
+        """
+        session.flush()
+        table = _get_tree_table(cls.__mapper__)
+        table_pk = getattr(table.c, cls.get_pk_column().name)
+        connection = compat_layer.connection(session, cls.__mapper__)
+
+        ranked = compat_layer.select(
+            table_pk.label("pk"),
+            table.c.parent_id,
+            table.c.tree_id,
+            cast(
+                func.row_number().over(
+                    partition_by=table.c.tree_id,
+                    order_by=(table.c.lft, table_pk)
+                ) + 1000000000,
+                Text
+            ).label("rank")
+        )
+        if tree_id is not None:
+            ranked = ranked.where(table.c.tree_id == tree_id)
+        ranked = ranked.cte("mptt_ranked")
+
+        paths = compat_layer.select(
+            ranked.c.pk,
+            ranked.c.tree_id,
+            literal(0).label("depth"),
+            cast(ranked.c.rank, _path_type).label("path")
+        ).where(
+            ranked.c.parent_id.is_(None)
+        ).cte("mptt_paths", recursive=True)
+        child = ranked.alias("mptt_child")
+        paths = paths.union_all(
+            compat_layer.select(
+                child.c.pk,
+                child.c.tree_id,
+                paths.c.depth + 1,
+                paths.c.path + child.c.rank
+            ).where(
+                child.c.parent_id == paths.c.pk
+            )
+        )
+
+        keys = compat_layer.subquery(union_all(
+            compat_layer.select(
+                paths.c.pk, paths.c.tree_id, paths.c.depth,
+                paths.c.path.label("key")
+            ),
+            compat_layer.select(
+                paths.c.pk, paths.c.tree_id, paths.c.depth,
+                (paths.c.path + "z").label("key")
+            ),
+        ), "mptt_keys")
+        positions = compat_layer.subquery(compat_layer.select(
+            keys.c.pk,
+            keys.c.depth,
+            func.row_number().over(
+                partition_by=keys.c.tree_id,
+                order_by=keys.c.key
+            ).label("position")
+        ), "mptt_positions")
+        numbered = compat_layer.select(
+            positions.c.pk,
+            func.min(positions.c.position).label("lft"),
+            func.max(positions.c.position).label("rgt"),
+            func.max(positions.c.depth).label("depth")
+        ).group_by(positions.c.pk).cte("mptt_numbered")
+
+        connection.execute(
+            table.update()
+            .where(table_pk == numbered.c.pk)
+            .values(
+                lft=numbered.c.lft,
+                rgt=numbered.c.rgt,
+                level=numbered.c.depth + cls.get_default_level()
+            )
+        )
+
+        base_class = cls.__mapper__.base_mapper.class_
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, base_class) and (
+                    tree_id is None
+                    or inspect(obj).dict.get("tree_id", tree_id) == tree_id):
+                session.expire(obj, ["left", "right", "level"])
+
+
+@event.listens_for(BaseNestedSets, 'instrument_class', propagate=True)
+def _declare_indexes(mapper, class_):
+    table = mapper.local_table
+    if not isinstance(table, Table) or not all(
+            key in table.c for key in ['level', 'lft', 'rgt', 'parent_id']):
+        # the tree columns belong to the table of a parent class
+        return
+    names = set(index.name for index in table.indexes)
+    for columns in class_.get_indexes() or ():
+        # conv() names are shortened with a hash suffix when they exceed
+        # the max_identifier_length of the dialect
+        name = conv("ix_%s_%s" % (table.name, "_".join(columns)))
+        if name not in names:
+            Index(name, *[table.c[column] for column in columns])
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Distributed under terms of the MIT license.
+"""
+Nested sets numbering of an adjacency list
+
+Giving the left, right and level values of nodes only known by their parent
+is an Euler tour of the tree. With NumPy installed (``pip install
+sqlalchemy_mptt[numpy]``) it is done with vectorized operations, one per
+level of the tree, otherwise with a plain depth first walk.
+
+.. code-block:: python
+
+    from sqlalchemy_mptt.numbering import number_tree
+
+    lefts, rights, levels = number_tree([1, 2, 3], [None, 1, 1])
+    # [1, 2, 4], [6, 3, 5], [1, 2, 2]
+"""
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+def number_tree(ids, parent_ids, order_keys=None, left=1, level=1,
+                vectorized=None):
+    """ Number the nodes ``ids`` of the trees described by ``parent_ids``.
+
+    A node whose parent is ``None`` is the root of a tree of its own, every
+    tree is numbered from ``left``.
+
+    Args:
+        ids (sequence): primary keys of the nodes
+        parent_ids (sequence): primary key of the parent of every node
+
+    Kwargs:
+        order_keys (sequence): siblings are numbered by this key, by default
+        in the order of ``ids``
+        left (int): left value of the roots
+        level (int): level of the roots
+        vectorized (bool): force or forbid the NumPy implementation, by
+        default it is used when NumPy is installed
+
+    Returns:
+        three lists, the left, right and level values of the nodes in the
+        order of ``ids``
+
+    Raises:
+        ValueError: some nodes are not below a root, their parent is not one
+        of ``ids`` or their parents form a cycle
+    """
+    if vectorized is None:
+        vectorized = numpy is not None
+    if vectorized:
+        return _number_tree_numpy(ids, parent_ids, order_keys, left, level)
+    return _number_tree_python(ids, parent_ids, order_keys, left, level)
+
+
+def _adjacency(ids, parent_ids, order_keys):
+    """ Positions of the roots and of the children of every node, sorted by
+    ``order_keys`` when given.
+    """
+    index = dict((pk, i) for i, pk in enumerate(ids))
+    children = {}
+    roots = []
+    for i, parent_id in enumerate(parent_ids):
+        if parent_id is None:
+            roots.append(i)
+        elif parent_id not in index:
+            raise ValueError("Parent %r is not numbered" % (parent_id,))
+        else:
+            children.setdefault(index[parent_id], []).append(i)
+    if order_keys is not None:
+        roots.sort(key=lambda i: order_keys[i])
+        for siblings in children.values():
+            siblings.sort(key=lambda i: order_keys[i])
+    return roots, children
+
+
+def _number_tree_python(ids, parent_ids, order_keys, left, level):
+    roots, children = _adjacency(ids, parent_ids, order_keys)
+    lefts = [None] * len(ids)
+    rights = [None] * len(ids)
+    levels = [None] * len(ids)
+    for root in roots:
+        position = left
+        path = []
+        stack = [iter([root])]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                if path:
+                    rights[path.pop()] = position
+                    position += 1
+                continue
+            lefts[node] = position
+            levels[node] = level + len(path)
+            position += 1
+            path.append(node)
+            stack.append(iter(children.get(node, ())))
+    if None in lefts:
+        raise ValueError("Some nodes are not below a root")
+    return lefts, rights, levels
+
+
+def _number_tree_numpy(ids, parent_ids, order_keys, left, level):
+    count = len(ids)
+    if not count:
+        return [], [], []
+
+    # Index of the parent of every node, -1 for the roots
+    ids = numpy.asarray(ids)
+    by_id = numpy.argsort(ids, kind="stable")
+    sorted_ids = ids[by_id]
+    has_parent = numpy.fromiter(
+        (parent_id is not None for parent_id in parent_ids), bool, count
+    )
+    parent = numpy.full(count, -1)
+    if has_parent.any():
+        wanted = numpy.asarray(
+            [parent_id for parent_id in parent_ids if parent_id is not None]
+        )
+        found = numpy.searchsorted(sorted_ids, wanted).clip(0, count - 1)
+        matched = sorted_ids[found] == wanted
+        if not matched.all():
+            raise ValueError(
+                "Parent %r is not numbered" % (wanted[~matched].tolist()[0],)
+            )
+        parent[numpy.flatnonzero(has_parent)] = by_id[found]
+
+    # Depth by pointer jumping, log2(depth) steps
+    depth = (parent >= 0).astype(numpy.int64)
+    ancestor = parent.copy()
+    for _ in range(count.bit_length() + 1):
+        going = ancestor >= 0
+        if not going.any():
+            break
+        step = ancestor[going]
+        depth[going] += depth[step]
+        ancestor[going] = ancestor[step]
+    else:
+        raise ValueError("Some nodes are not below a root")
+
+    # Siblings sorted by their key, grouped by parent
+    if order_keys is None:
+        order_keys = numpy.arange(count)
+    siblings = numpy.lexsort((numpy.asarray(order_keys), parent))
+    levels_order = numpy.argsort(depth, kind="stable")
+    bounds = numpy.searchsorted(depth[levels_order],
+                                numpy.arange(depth.max() + 2))
+    by_level = [levels_order[bounds[d]:bounds[d + 1]]
+                for d in range(len(bounds) - 1)]
+
+    # Subtree sizes, bottom-up one level at a time
+    size = numpy.ones(count, numpy.int64)
+    for nodes in reversed(by_level[1:]):
+        numpy.add.at(size, parent[nodes], size[nodes])
+
+    # Keys taken by the earlier siblings of every node
+    width = 2 * size[siblings]
+    taken = numpy.cumsum(width) - width
+    first = numpy.ones(count, bool)
+    first[1:] = parent[siblings][1:] != parent[siblings][:-1]
+    group_start = numpy.maximum.accumulate(
+        numpy.where(first, numpy.arange(count), 0)
+    )
+    offset = numpy.empty(count, numpy.int64)
+    offset[siblings] = taken - taken[group_start]
+
+    # Left values top-down one level at a time
+    lefts = numpy.empty(count, numpy.int64)
+    lefts[by_level[0]] = left
+    for nodes in by_level[1:]:
+        lefts[nodes] = lefts[parent[nodes]] + 1 + offset[nodes]
+    rights = lefts + 2 * size - 1
+    return lefts.tolist(), rights.tolist(), (depth + level).tolist()
@@ -27,6 +27,23 @@ class LegacySQLAlchemyAPI:
     def get(session, model, id):
         return session.query(model).get(id)
 
+    @staticmethod
+    def connection(session, mapper):
+        return session.connection(mapper=mapper)
+
+    @staticmethod
+    def ordered_update(table, *values):
+        return table.update(preserve_parameter_order=True).values(list(values))
+
+    @staticmethod
+    def subquery(select, name):
+        return select.alias(name)
+
+    @staticmethod
+    def supports_update_from(dialect):
+        # CTEs can't be used by the UPDATE statements
+        return False
+
 
 class ModernSQLAlchemyAPI:
     """A class to provide compatibility for modern SQLAlchemy versions (1.4+)."""
@@ -48,6 +65,27 @@ class ModernSQLAlchemyAPI:
     def get(session, model, id):
         return session.get(model, id)
 
+    @staticmethod
+    def connection(session, mapper):
+        return session.connection(bind_arguments={"mapper": mapper})
+
+    @staticmethod
+    def ordered_update(table, *values):
+        return table.update().ordered_values(*values)
+
+    @staticmethod
+    def subquery(select, name):
+        return select.subquery(name)
+
+    @staticmethod
+    def supports_update_from(dialect):
+        from sqlalchemy.sql.compiler import SQLCompiler
+        compiler = dialect.statement_compiler
+        if compiler.update_from_clause is SQLCompiler.update_from_clause:
+            return False
+        return dialect.name != "sqlite" or \
+            dialect.server_version_info >= (3, 33)
+
 
 if sa.__version__ < '1.4':
     compat_layer = LegacySQLAlchemyAPI()
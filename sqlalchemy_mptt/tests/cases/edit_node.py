@@ -1,3 +1,11 @@
+import warnings
+
+from sqlalchemy_mptt import tree_manager
+from sqlalchemy_mptt.events import _get_tree_table
+from sqlalchemy_mptt.hooks import SlowOperationLogger, TreeHook
+from sqlalchemy_mptt.sqlalchemy_compat import compat_layer
+
+
 class Changes(object):
 
     def test_update_wo_move(self):
@@ -50,6 +58,33 @@ class Changes(object):
             ],
             self.result.all())  # flake8: noqa
 
+    def test_update_wo_move_without_tree_queries(self):
+        """ Change attr of node(1) with a big subtree: only the node row is
+        updated, the tree is not queried
+        """
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 1).one()
+        node.visible = not node.visible
+        self.start_query_counter()
+        self.session.flush()
+        self.stop_query_counter()
+        self.assertEqual(1, len(self.stmts))
+        self.assertTrue(self.stmts[0].startswith('UPDATE'))
+
+    def test_update_wo_move_after_move(self):
+        """ A done move is not repeated by the next flush of the node
+        """
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 8).one()
+        node.move_after("5")
+        self.session.flush()
+        node.visible = not node.visible
+        self.start_query_counter()
+        self.session.flush()
+        self.stop_query_counter()
+        self.assertEqual(1, len(self.stmts))
+        self.assertTrue(self.stmts[0].startswith('UPDATE'))
+
     def test_update_wo_move_like_sacrud_save(self):
         """ Just change attr from node w/o move
         initial state of the tree :mod:`sqlalchemy_mptt.tests.add_mptt_tree`
@@ -217,6 +252,240 @@ class Changes(object):
             ],
             self.result.all())
 
+    def test_insert_nodes_in_one_flush(self):
+        """ New nodes of one flush are grouped by parent: one shift per parent
+
+        .. code::
+
+            level     Insert nodes 23, 24 and 25 under 6 and node 26 under 4
+            1                    1(1)30
+                    _______________|______________________
+                   |               |                      |
+            2    2(2)5           6(4)19                20(7)29
+                   |        _______|________           ___|____
+                   |       |       |        |         |        |
+            3    3(3)4   7(5)8  9(6)16  17(26)18  21(8)24  25(10)28
+                              ____|____              |         |
+            4                |         |         22(9)23   26(11)27
+                         10(23)13  14(24)15
+                             |
+            5            11(25)12
+        """
+        pk_name = self.model.get_pk_name()
+        node4 = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 4).one()
+        node26 = self.model(**{pk_name: 26})
+        self.session.add_all([
+            self.model(**{pk_name: 23, 'parent_id': 6}),
+            self.model(**{pk_name: 24, 'parent_id': 6}),
+            self.model(**{pk_name: 25, 'parent_id': 23}),
+            node26,
+        ])
+        node26.parent = node4
+        self.start_query_counter()
+        self.session.flush()
+        self.stop_query_counter()
+        # parents are loaded at once, then one UPDATE of the right side per
+        # parent and no shift per node
+        self.assertEqual(
+            ['SELECT', 'UPDATE', 'UPDATE'],
+            [stmt.split()[0] for stmt in self.stmts[:3]]
+        )
+        self.assertEqual(
+            2, len([stmt for stmt in self.stmts if stmt.startswith('UPDATE')])
+        )
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            [
+                # id lft rgt lvl parent tree
+                (1,   1, 30, _level + 0, None, 1),
+                (2,   2,  5, _level + 1,  1, 1),
+                (3,   3,  4, _level + 2,  2, 1),
+                (4,   6, 19, _level + 1,  1, 1),
+                (5,   7,  8, _level + 2,  4, 1),
+                (6,   9, 16, _level + 2,  4, 1),
+                (7,  20, 29, _level + 1,  1, 1),
+                (8,  21, 24, _level + 2,  7, 1),
+                (9,  22, 23, _level + 3,  8, 1),
+                (10, 25, 28, _level + 2,  7, 1),
+                (11, 26, 27, _level + 3, 10, 1),
+
+                (12,  1, 22, _level + 0, None, 2),
+                (13,  2,  5, _level + 1, 12, 2),
+                (14,  3,  4, _level + 2, 13, 2),
+                (15,  6, 11, _level + 1, 12, 2),
+                (16,  7,  8, _level + 2, 15, 2),
+                (17,  9, 10, _level + 2, 15, 2),
+                (18, 12, 21, _level + 1, 12, 2),
+                (19, 13, 16, _level + 2, 18, 2),
+                (20, 14, 15, _level + 3, 19, 2),
+                (21, 17, 20, _level + 2, 18, 2),
+                (22, 18, 19, _level + 3, 21, 2),
+
+                (23, 10, 13, _level + 3,  6, 1),
+                (24, 14, 15, _level + 3,  6, 1),
+                (25, 11, 12, _level + 4, 23, 1),
+                (26, 17, 18, _level + 2,  4, 1)
+            ],
+            self.result.all())
+
+    def test_insert_nodes_in_flush_of_some_objects(self):
+        """ Only the nodes given to ``session.flush(objects)`` are planned
+        """
+        pk_name = self.model.get_pk_name()
+        node23 = self.model(**{pk_name: 23, 'parent_id': 6})
+        node24 = self.model(**{pk_name: 24, 'parent_id': 6})
+        self.session.add_all([node23, node24])
+        with warnings.catch_warnings():
+            # deprecated since SQLAlchemy 2.1
+            warnings.simplefilter('ignore', DeprecationWarning)
+            self.session.flush([node23])
+        self.assertIn(node24, self.session.new)
+        with self.session.no_autoflush:
+            self.assertEqual(
+                [(1, 1, 24), (6, 9, 12), (23, 10, 11)],
+                [(node[0], node[1], node[2]) for node in self.result.filter(
+                    self.model.get_pk_column().in_([1, 6, 23, 24])
+                ).order_by(self.model.get_pk_column())]
+            )
+        self.session.flush()
+        self.assertEqual(
+            [(1, 1, 26), (6, 9, 14), (23, 10, 11), (24, 12, 13)],
+            [(node[0], node[1], node[2]) for node in self.result.filter(
+                self.model.get_pk_column().in_([1, 6, 23, 24])
+            ).order_by(self.model.get_pk_column())]
+        )
+
+    def test_bulk_insert_tree(self):
+        """ Insert subtree with parent==6 in a few statements
+
+        .. code::
+
+            level     Insert nodes 23, 24 and 25 under node 6
+            1                    1(1)28
+                    _______________|_________________
+                   |               |                 |
+            2    2(2)5           6(4)17           18(7)27
+                   |           ____|____          ___|____
+                   |          |         |        |        |
+            3    3(3)4      7(5)8    9(6)16   19(8)22  23(10)26
+                                   ____|____    |         |
+            4                     |         | 20(9)21  24(11)25
+                              10(23)13  14(25)15
+                                  |
+            5                 11(24)12
+        """
+        pk_name = self.model.get_pk_name()
+        parent = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 6).one()
+        self.session.flush()
+        self.start_query_counter()
+        self.model.bulk_insert_tree(
+            self.session,
+            [{pk_name: 23, 'children': [{pk_name: 24}]}, {pk_name: 25}],
+            parent=parent
+        )
+        self.stop_query_counter()
+        # SELECT parent, UPDATE right side, INSERT per mapped table
+        self.assertEqual(
+            len(self.stmts), 2 + len(self.model.__mapper__.tables)
+        )
+        self.assertEqual(parent.right, 16)
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            [
+                # id lft rgt lvl parent tree
+                (1,   1, 28, _level + 0, None, 1),
+                (2,   2,  5, _level + 1,  1, 1),
+                (3,   3,  4, _level + 2,  2, 1),
+                (4,   6, 17, _level + 1,  1, 1),
+                (5,   7,  8, _level + 2,  4, 1),
+                (6,   9, 16, _level + 2,  4, 1),
+                (7,  18, 27, _level + 1,  1, 1),
+                (8,  19, 22, _level + 2,  7, 1),
+                (9,  20, 21, _level + 3,  8, 1),
+                (10, 23, 26, _level + 2,  7, 1),
+                (11, 24, 25, _level + 3, 10, 1),
+
+                (12,  1, 22, _level + 0, None, 2),
+                (13,  2,  5, _level + 1, 12, 2),
+                (14,  3,  4, _level + 2, 13, 2),
+                (15,  6, 11, _level + 1, 12, 2),
+                (16,  7,  8, _level + 2, 15, 2),
+                (17,  9, 10, _level + 2, 15, 2),
+                (18, 12, 21, _level + 1, 12, 2),
+                (19, 13, 16, _level + 2, 18, 2),
+                (20, 14, 15, _level + 3, 19, 2),
+                (21, 17, 20, _level + 2, 18, 2),
+                (22, 18, 19, _level + 3, 21, 2),
+
+                (23, 10, 13, _level + 3,  6, 1),
+                (24, 11, 12, _level + 4, 23, 1),
+                (25, 14, 15, _level + 3,  6, 1)
+            ],
+            self.result.all())
+
+    def test_bulk_insert_tree_as_new_trees(self):
+        """ Every top level node of the structure becomes a new tree
+        """
+        pk_name = self.model.get_pk_name()
+        self.model.bulk_insert_tree(
+            self.session,
+            [
+                {pk_name: 23, 'children': [
+                    {pk_name: 24, 'children': [{pk_name: 25}]},
+                    {pk_name: 26}]},
+                {pk_name: 27}
+            ]
+        )
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            [
+                # id lft rgt lvl parent tree
+                (23, 1, 8, _level + 0, None, 3),
+                (24, 2, 5, _level + 1, 23, 3),
+                (25, 3, 4, _level + 2, 24, 3),
+                (26, 6, 7, _level + 1, 23, 3),
+                (27, 1, 2, _level + 0, None, 4)
+            ],
+            self.result.filter(self.model.tree_id > 2)
+            .order_by(self.model.get_pk_column()).all())
+
+    def test_bulk_insert_tree_with_generated_pk(self):
+        """ Children are linked to parents whose pk comes from the database
+        """
+        parent = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 6).one()
+        self.model.bulk_insert_tree(
+            self.session,
+            [{'children': [{'children': [{}]}, {}]}],
+            parent=parent
+        )
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            [
+                # id lft rgt lvl parent tree
+                (23, 10, 17, _level + 3,  6, 1),
+                (24, 11, 14, _level + 4, 23, 1),
+                (25, 12, 13, _level + 5, 24, 1),
+                (26, 15, 16, _level + 4, 23, 1)
+            ],
+            self.result.filter(self.model.get_pk_column() > 22).all())
+
+    def test_bulk_insert_tree_with_unloaded_tree_id(self):
+        """ Keys of a loaded node are refreshed even when its tree_id is not
+        """
+        root = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 1).one()
+        self.assertEqual(root.right, 22)
+        self.session.expire(root, ['tree_id'])
+        parent = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 6).one()
+        self.model.bulk_insert_tree(
+            self.session, [{'children': [{}]}], parent=parent
+        )
+        self.assertEqual(root.right, 26)
+
     def test_insert_after_node(self):
         pass
 
@@ -275,6 +544,77 @@ class Changes(object):
             ],
             self.result.all())
 
+    def test_delete_subtree(self):
+        """ Delete node(7) with its descendants at once
+        initial state of the tree :mod:`sqlalchemy_mptt.tests.add_mptt_tree`
+
+        .. code::
+
+            level           Test delete subtree
+            1                    1(1)22
+                    _______________|___________________
+                   |               |                   |
+            2    2(2)5           6(4)11             12(7)21
+                   |               ^                   ^
+            3    3(3)4       7(5)8   9(6)10    13(8)16   17(10)20
+                                                  |          |
+            4                                  14(9)15   18(11)19
+            level         Delete subtree == 7
+            1                    1(1)12
+                    _______________|
+                   |               |
+            2    2(2)5           6(4)11
+                   |               ^
+            3    3(3)4       7(5)8   9(6)10
+        """
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 7).one()
+        descendant = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 9).one()
+        root = node.parent
+        self.assertEqual(len(root.children), 3)
+        self.session.flush()
+
+        self.start_query_counter()
+        node.delete_subtree()
+        self.stop_query_counter()
+        # SELECT node, SELECT primary keys of the subtree, DELETE subtree
+        # (from each table of joined inheritance), UPDATE right side
+        kinds = [stmt.split()[0] for stmt in self.stmts]
+        self.assertEqual(kinds[:2], ['SELECT', 'SELECT'])
+        self.assertEqual(kinds[-1], 'UPDATE')
+        self.assertEqual(set(kinds[2:-1]), set(['DELETE']))
+        self.assertNotIn(node, self.session)
+        self.assertNotIn(descendant, self.session)
+        self.assertEqual(root.right, 12)
+        self.assertEqual(len(root.children), 2)
+        self.session.commit()
+
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            [
+                # id lft rgt lvl parent tree
+                (1,   1, 12, _level + 0, None, 1),
+                (2,   2,  5, _level + 1,  1, 1),
+                (3,   3,  4, _level + 2,  2, 1),
+                (4,   6, 11, _level + 1,  1, 1),
+                (5,   7,  8, _level + 2,  4, 1),
+                (6,   9, 10, _level + 2,  4, 1),
+
+                (12,  1, 22, _level + 0, None, 2),
+                (13,  2,  5, _level + 1, 12, 2),
+                (14,  3,  4, _level + 2, 13, 2),
+                (15,  6, 11, _level + 1, 12, 2),
+                (16,  7,  8, _level + 2, 15, 2),
+                (17,  9, 10, _level + 2, 15, 2),
+                (18, 12, 21, _level + 1, 12, 2),
+                (19, 13, 16, _level + 2, 18, 2),
+                (20, 14, 15, _level + 3, 19, 2),
+                (21, 17, 20, _level + 2, 18, 2),
+                (22, 18, 19, _level + 3, 21, 2)
+            ],
+            self.result.all())
+
     def test_update_node(self):
         """ Set parent_id==5 for node(8)
         initial state of the tree :mod:`sqlalchemy_mptt.tests.add_mptt_tree`
@@ -457,6 +797,499 @@ class Changes(object):
             ],
             self.result.all())
 
+    def test_tree_manager_stats(self):
+        """ Count the nodes, statements and rows of the tree writes
+        """
+        tree_manager.reset_stats(self.session)
+        before = tree_manager.stats()
+
+        self.session.add(self.model(parent_id=6))
+        self.session.flush()
+        stats = tree_manager.stats(self.session)
+        self.assertEqual(
+            # parent 6 and the 7 nodes at its right side are shifted
+            {'inserts': 1, 'moves': 0, 'deletes': 0, 'selects': 1,
+             'updates': 1, 'shifted_rows': 8},
+            dict((key, stats[key]) for key in (
+                'inserts', 'moves', 'deletes', 'selects', 'updates',
+                'shifted_rows'
+            ))
+        )
+        self.assertGreater(stats['time_before_flush'], 0)
+
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 9).one()
+        self.session.delete(node)
+        self.session.flush()
+        stats = tree_manager.stats(self.session)
+        self.assertEqual(1, stats['deletes'])
+        self.assertGreater(stats['time_before_delete'], 0)
+        self.assertEqual(
+            1, tree_manager.stats()['deletes'] - before['deletes']
+        )
+
+        tree_manager.reset_stats(self.session)
+        self.assertEqual(0, tree_manager.stats(self.session)['inserts'])
+
+    def test_tree_manager_hooks(self):
+        """ Trace the statements of a move with a hook
+        """
+        calls = []
+
+        class Recorder(TreeHook):
+            def on_operation_start(self, operation):
+                calls.append(('start', operation.kind, operation.model))
+
+            def on_operation_end(self, operation):
+                calls.append(('end', operation.kind, operation.tree_id,
+                              operation.statements, operation.rowcount))
+
+            def on_statement(self, operation, statement, tree_id, window,
+                             rowcount, duration):
+                calls.append((str(statement).split()[0], tree_id, window,
+                              rowcount))
+
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 10).one()
+        node.move_inside(4)
+        hook = Recorder()
+        logger = SlowOperationLogger(threshold=0)
+        tree_manager.add_hook(hook)
+        tree_manager.add_hook(logger)
+        try:
+            with self.assertLogs('sqlalchemy_mptt', 'WARNING') as logs:
+                self.session.flush()
+        finally:
+            tree_manager.remove_hook(hook)
+            tree_manager.remove_hook(logger)
+
+        self.assertEqual(
+            [
+                ('start', 'move', self.model),
+                ('SELECT', None, None, None),
+                ('SELECT', None, None, None),
+                # 4, its children and the nodes up to the old place of 10
+                ('UPDATE', 1, (7, 20), 8),
+                ('end', 'move', 1, 3, 8),
+            ],
+            calls
+        )
+        self.assertEqual(1, len(logs.output))
+        self.assertIn('Slow move of', logs.output[0])
+
+    def test_tree_manager_hooks_delete(self):
+        """ The rows deleted are given to the hooks
+        """
+        calls = []
+
+        class Recorder(TreeHook):
+            def on_operation_end(self, operation):
+                calls.append(('end', operation.kind, operation.statements,
+                              operation.rowcount))
+
+            def on_statement(self, operation, statement, tree_id, window,
+                             rowcount, duration):
+                calls.append((str(statement).split()[0], tree_id, window,
+                              rowcount))
+
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 9).one()
+        self.session.delete(node)
+        hook = Recorder()
+        tree_manager.add_hook(hook)
+        try:
+            self.session.flush()
+        finally:
+            tree_manager.remove_hook(hook)
+
+        self.assertEqual(
+            [
+                ('SELECT', None, None, None),
+                ('DELETE', None, None, 1),
+                # the nodes right of 9
+                ('UPDATE', 1, (14, None), 5),
+                ('end', 'delete', 3, 6),
+            ],
+            calls
+        )
+
+    def test_delete_subtree_with_loaded_children(self):
+        """ Delete node(7) when the children of its descendants are loaded
+        and some of them have expired keys
+        """
+        def get(pk):
+            return self.session.query(self.model)\
+                .filter(self.model.get_pk_column() == pk).one()
+
+        node7, node8, node9, node10 = get(7), get(8), get(9), get(10)
+        self.assertEqual(node8.children, [node9])
+        self.session.expire(node10, ['tree_id', 'left', 'right'])
+
+        node7.delete_subtree()
+        for node in (node7, node8, node9, node10):
+            self.assertNotIn(node, self.session)
+        get(1).visible = True
+        self.session.flush()
+        self.assertEqual(get(1).right, 12)
+        self.assertEqual(
+            [], self.result.filter(self.model.get_pk_column() > 6)
+            .filter(self.model.tree_id == 1).all()
+        )
+
+    def test_rebuild_subtree(self):
+        """ Repair the subtree of node(7) after node(9) was moved under
+        node(10) and node(23) added under node(8) without MPTT events
+
+        .. code::
+
+            level           Nested sets example
+            1                    1(1)22
+                    _______________|___________________
+                   |               |                   |
+            2    2(2)5           6(4)11             12(7)21
+                   |               ^                   ^
+            3    3(3)4       7(5)8   9(6)10    13(8)16   17(10)20
+                                                  |          |
+            4                                  14(9)15   18(11)19
+
+            level           Rebuild subtree of node 7
+            1                    1(1)24
+                    _______________|___________________
+                   |               |                   |
+            2    2(2)5           6(4)11             12(7)23
+                   |               ^                   ^
+            3    3(3)4       7(5)8   9(6)10    13(8)16   17(10)22
+                                                  |         ^
+            4                                 14(23)15 18(9)19 20(11)21
+        """
+        from sqlalchemy_mptt import tree_manager
+
+        pk_name = self.model.get_pk_name()
+        tree_manager.register_events(remove=True)
+        try:
+            self.session.add(self.model(**{
+                pk_name: 23, 'parent_id': 8, 'tree_id': 1,
+                'left': 0, 'right': 0, 'level': 0
+            }))
+            node9 = self.session.query(self.model)\
+                .filter(self.model.get_pk_column() == 9).one()
+            node9.parent_id = 10
+            self.session.flush()
+        finally:
+            tree_manager.register_events()
+
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 7).one()
+        node.rebuild_subtree()
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            [
+                # id lft rgt lvl parent tree
+                (1,   1, 24, _level + 0, None, 1),
+                (2,   2,  5, _level + 1,  1, 1),
+                (3,   3,  4, _level + 2,  2, 1),
+                (4,   6, 11, _level + 1,  1, 1),
+                (5,   7,  8, _level + 2,  4, 1),
+                (6,   9, 10, _level + 2,  4, 1),
+                (7,  12, 23, _level + 1,  1, 1),
+                (8,  13, 16, _level + 2,  7, 1),
+                (9,  18, 19, _level + 3, 10, 1),
+                (10, 17, 22, _level + 2,  7, 1),
+                (11, 20, 21, _level + 3, 10, 1),
+
+                (12,  1, 22, _level + 0, None, 2),
+                (13,  2,  5, _level + 1, 12, 2),
+                (14,  3,  4, _level + 2, 13, 2),
+                (15,  6, 11, _level + 1, 12, 2),
+                (16,  7,  8, _level + 2, 15, 2),
+                (17,  9, 10, _level + 2, 15, 2),
+                (18, 12, 21, _level + 1, 12, 2),
+                (19, 13, 16, _level + 2, 18, 2),
+                (20, 14, 15, _level + 3, 19, 2),
+                (21, 17, 20, _level + 2, 18, 2),
+                (22, 18, 19, _level + 3, 21, 2),
+
+                (23, 14, 15, _level + 3,  8, 1)
+            ],
+            self.result.order_by(self.model.get_pk_column()).all())
+        self.assertEqual(node.right, 23)
+
+    def test_rebuild_subtree_with_cycle(self):
+        """ Rebuilding a subtree whose parent_id values form a cycle raises
+        instead of walking it forever
+        """
+        table = _get_tree_table(self.model.__mapper__)
+        self.session.execute(
+            table.update().where(getattr(
+                table.c, self.model.get_pk_column().name) == 2
+            ).values(parent_id=3)
+        )
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 2).one()
+        self.assertRaises(ValueError, node.rebuild_subtree)
+
+    def test_rebuild_queries(self):
+        """ Rebuild reads the tree with one query and writes it with one
+        executemany
+        """
+        table = _get_tree_table(self.model.__mapper__)
+        self.session.execute(
+            table.update().where(table.c.tree_id == 1)
+            .values(lft=0, rgt=0, level=0)
+        )
+        self.start_query_counter()
+        self.model.rebuild_tree(self.session, 1)
+        self.stop_query_counter()
+        self.assertEqual(
+            ['SELECT', 'UPDATE'],
+            [stmt.split()[0] for stmt in self.stmts]
+        )
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            self.result.filter(self.model.tree_id == 1)
+            .order_by(self.model.get_pk_column()).all(),
+            [
+                # id lft rgt lvl parent tree
+                (1,   1, 22, _level + 0, None, 1),
+                (2,   2,  5, _level + 1, 1,  1),
+                (3,   3,  4, _level + 2, 2,  1),
+                (4,   6, 11, _level + 1, 1,  1),
+                (5,   7,  8, _level + 2, 4,  1),
+                (6,   9, 10, _level + 2, 4,  1),
+                (7,  12, 21, _level + 1, 1,  1),
+                (8,  13, 16, _level + 2, 7,  1),
+                (9,  14, 15, _level + 3, 8,  1),
+                (10, 17, 20, _level + 2, 7,  1),
+                (11, 18, 19, _level + 3, 10, 1),
+            ]
+        )
+
+    def test_rebuild_tree_with_orphan(self):
+        """ Rebuild refuses a tree with a node whose parent is elsewhere
+        instead of numbering it over the root
+        """
+        table = _get_tree_table(self.model.__mapper__)
+        self.session.execute(
+            table.update().where(getattr(
+                table.c, self.model.get_pk_column().name) == 8
+            ).values(parent_id=13)
+        )
+        self.assertRaises(
+            ValueError, self.model.rebuild_tree, self.session, 1
+        )
+
+    def test_rebuild_server_side(self):
+        """ Rebuild all the trees with one UPDATE computed by the database
+        """
+        table = _get_tree_table(self.model.__mapper__)
+        self.session.execute(
+            table.update().values(lft=0, rgt=0, level=0)
+        )
+        self.start_query_counter()
+        self.model.rebuild(self.session, server_side=True)
+        self.stop_query_counter()
+        if compat_layer.supports_update_from(self.session.bind.dialect):
+            self.assertEqual(
+                ['WITH'],
+                [stmt.split()[0] for stmt in self.stmts]
+            )
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            self.result.order_by(self.model.get_pk_column()).all(),
+            [
+                # id lft rgt lvl parent tree
+                (1,   1, 22, _level + 0, None, 1),
+                (2,   2,  5, _level + 1, 1,  1),
+                (3,   3,  4, _level + 2, 2,  1),
+                (4,   6, 11, _level + 1, 1,  1),
+                (5,   7,  8, _level + 2, 4,  1),
+                (6,   9, 10, _level + 2, 4,  1),
+                (7,  12, 21, _level + 1, 1,  1),
+                (8,  13, 16, _level + 2, 7,  1),
+                (9,  14, 15, _level + 3, 8,  1),
+                (10, 17, 20, _level + 2, 7,  1),
+                (11, 18, 19, _level + 3, 10, 1),
+
+                (12,  1, 22, _level + 0, None, 2),
+                (13,  2,  5, _level + 1, 12, 2),
+                (14,  3,  4, _level + 2, 13, 2),
+                (15,  6, 11, _level + 1, 12, 2),
+                (16,  7,  8, _level + 2, 15, 2),
+                (17,  9, 10, _level + 2, 15, 2),
+                (18, 12, 21, _level + 1, 12, 2),
+                (19, 13, 16, _level + 2, 18, 2),
+                (20, 14, 15, _level + 3, 19, 2),
+                (21, 17, 20, _level + 2, 18, 2),
+                (22, 18, 19, _level + 3, 21, 2)
+            ]
+        )
+
+    def test_rebuild_streaming(self):
+        """ Rebuild all the trees walking them from the database, with
+        batches smaller than the tree
+        """
+        table = _get_tree_table(self.model.__mapper__)
+        self.session.execute(
+            table.update().values(lft=0, rgt=0, level=0)
+        )
+        self.model.rebuild(self.session, streaming=True, batch_size=3)
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            self.result.order_by(self.model.get_pk_column()).all(),
+            [
+                # id lft rgt lvl parent tree
+                (1,   1, 22, _level + 0, None, 1),
+                (2,   2,  5, _level + 1, 1,  1),
+                (3,   3,  4, _level + 2, 2,  1),
+                (4,   6, 11, _level + 1, 1,  1),
+                (5,   7,  8, _level + 2, 4,  1),
+                (6,   9, 10, _level + 2, 4,  1),
+                (7,  12, 21, _level + 1, 1,  1),
+                (8,  13, 16, _level + 2, 7,  1),
+                (9,  14, 15, _level + 3, 8,  1),
+                (10, 17, 20, _level + 2, 7,  1),
+                (11, 18, 19, _level + 3, 10, 1),
+
+                (12,  1, 22, _level + 0, None, 2),
+                (13,  2,  5, _level + 1, 12, 2),
+                (14,  3,  4, _level + 2, 13, 2),
+                (15,  6, 11, _level + 1, 12, 2),
+                (16,  7,  8, _level + 2, 15, 2),
+                (17,  9, 10, _level + 2, 15, 2),
+                (18, 12, 21, _level + 1, 12, 2),
+                (19, 13, 16, _level + 2, 18, 2),
+                (20, 14, 15, _level + 3, 19, 2),
+                (21, 17, 20, _level + 2, 18, 2),
+                (22, 18, 19, _level + 3, 21, 2)
+            ]
+        )
+
+    def test_rebuild_streaming_negative_keys(self):
+        """ The streaming rebuild repairs nodes whose left key is negative
+        """
+        table = _get_tree_table(self.model.__mapper__)
+        table_pk = getattr(table.c, self.model.get_pk_column().name)
+        self.session.execute(
+            table.update().where(table_pk == 7).values(lft=-3)
+        )
+        self.session.execute(
+            table.update().where(table_pk == 8).values(lft=0)
+        )
+        self.model.rebuild(self.session, streaming=True)
+        _level = self.model.get_default_level()
+        # node(7) comes first among its siblings, as in the rebuild in
+        # memory ordering them by their left key
+        self.assertEqual(
+            self.result.filter(self.model.tree_id == 1)
+            .order_by(self.model.get_pk_column()).all(),
+            [
+                # id lft rgt lvl parent tree
+                (1,   1, 22, _level + 0, None, 1),
+                (2,  12, 15, _level + 1, 1,  1),
+                (3,  13, 14, _level + 2, 2,  1),
+                (4,  16, 21, _level + 1, 1,  1),
+                (5,  17, 18, _level + 2, 4,  1),
+                (6,  19, 20, _level + 2, 4,  1),
+                (7,   2, 11, _level + 1, 1,  1),
+                (8,   3,  6, _level + 2, 7,  1),
+                (9,   4,  5, _level + 3, 8,  1),
+                (10,  7, 10, _level + 2, 7,  1),
+                (11,  8,  9, _level + 3, 10, 1),
+            ]
+        )
+
+    def test_rebuild_streaming_queries(self):
+        """ The streaming rebuild reads the children of many nodes at once:
+        one page for every level of these small trees
+        """
+        self.start_query_counter()
+        self.model.rebuild_tree(self.session, 1, streaming=True)
+        self.stop_query_counter()
+        # negative keys, roots, 4 levels, the executemany of the keys and
+        # their sign
+        self.assertEqual(
+            ['UPDATE'] + ['SELECT'] * 5 + ['UPDATE', 'UPDATE'],
+            [stmt.split()[0] for stmt in self.stmts]
+        )
+
+    def test_initialize_from_adjacency(self):
+        """ Fill the nested sets columns of rows only known by their parent
+        """
+        table = _get_tree_table(self.model.__mapper__)
+        self.session.execute(
+            table.update().values(tree_id=None, lft=0, rgt=0, level=0)
+        )
+        self.start_query_counter()
+        self.model.initialize_from_adjacency(self.session, batch_size=10)
+        self.stop_query_counter()
+        self.assertEqual(
+            ['SELECT', 'SELECT', 'UPDATE', 'UPDATE', 'UPDATE'],
+            [stmt.split()[0] for stmt in self.stmts]
+        )
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            self.result.order_by(self.model.get_pk_column()).all(),
+            [
+                # id lft rgt lvl parent tree
+                (1,   1, 22, _level + 0, None, 1),
+                (2,   2,  5, _level + 1, 1,  1),
+                (3,   3,  4, _level + 2, 2,  1),
+                (4,   6, 11, _level + 1, 1,  1),
+                (5,   7,  8, _level + 2, 4,  1),
+                (6,   9, 10, _level + 2, 4,  1),
+                (7,  12, 21, _level + 1, 1,  1),
+                (8,  13, 16, _level + 2, 7,  1),
+                (9,  14, 15, _level + 3, 8,  1),
+                (10, 17, 20, _level + 2, 7,  1),
+                (11, 18, 19, _level + 3, 10, 1),
+
+                (12,  1, 22, _level + 0, None, 2),
+                (13,  2,  5, _level + 1, 12, 2),
+                (14,  3,  4, _level + 2, 13, 2),
+                (15,  6, 11, _level + 1, 12, 2),
+                (16,  7,  8, _level + 2, 15, 2),
+                (17,  9, 10, _level + 2, 15, 2),
+                (18, 12, 21, _level + 1, 12, 2),
+                (19, 13, 16, _level + 2, 18, 2),
+                (20, 14, 15, _level + 3, 19, 2),
+                (21, 17, 20, _level + 2, 18, 2),
+                (22, 18, 19, _level + 3, 21, 2)
+            ]
+        )
+
+    def test_initialize_from_adjacency_with_dangling_parent(self):
+        """ A node whose parent does not exist becomes the root of a tree
+        """
+        table = _get_tree_table(self.model.__mapper__)
+        self.session.execute(
+            table.update().values(tree_id=None, lft=0, rgt=0, level=0)
+        )
+        self.session.execute(
+            table.update().where(getattr(
+                table.c, self.model.get_pk_column().name) == 13
+            ).values(parent_id=99)
+        )
+        self.model.initialize_from_adjacency(self.session)
+        _level = self.model.get_default_level()
+        self.assertEqual(
+            self.result.filter(self.model.get_pk_column() > 11)
+            .order_by(self.model.get_pk_column()).all(),
+            [
+                # id lft rgt lvl parent tree
+                (12,  1, 18, _level + 0, None, 2),
+                (13,  1,  4, _level + 0, 99, 3),
+                (14,  2,  3, _level + 1, 13, 3),
+                (15,  2,  7, _level + 1, 12, 2),
+                (16,  3,  4, _level + 2, 15, 2),
+                (17,  5,  6, _level + 2, 15, 2),
+                (18,  8, 17, _level + 1, 12, 2),
+                (19,  9, 12, _level + 2, 18, 2),
+                (20, 10, 11, _level + 3, 19, 2),
+                (21, 13, 16, _level + 2, 18, 2),
+                (22, 14, 15, _level + 3, 21, 2)
+            ]
+        )
+
     def test_rebuild(self):
         """ Rebuild tree with tree_id==1
 
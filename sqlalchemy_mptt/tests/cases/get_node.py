@@ -79,3 +79,85 @@ class GetNodes(object):
             self.session.query(self.model).filter(self.model.get_pk_column() == 9).one()
         )
         self.assertEqual([], node9.get_children().all())  # flake8: noqa
+
+    def test_get_previous_and_next_sibling(self):
+        """
+        Get the siblings right before and after a node
+
+        initial state of the tree :mod:`sqlalchemy_mptt.tests.add_mptt_tree`
+
+        .. code::
+
+            level           Nested sets example
+                1                    1(1)22                              (12)
+                        _______________|___________________
+                       |               |                   |
+                2    2(2)5           6(4)11             12(7)21
+                       |               ^                   ^
+                3    3(3)4       7(5)8   9(6)10    13(8)16   17(10)20
+                                                      |          |
+                4                                  14(9)15   18(11)19
+
+        """
+        def get(pk):
+            return (
+                self.session.query(self.model)
+                .filter(self.model.get_pk_column() == pk)
+                .one()
+            )
+
+        self.assertEqual(get(2), get(4).get_previous_sibling())
+        self.assertEqual(get(7), get(4).get_next_sibling())
+        self.assertEqual(get(8), get(10).get_previous_sibling())
+        self.assertEqual(None, get(10).get_next_sibling())
+        self.assertEqual(None, get(8).get_previous_sibling())
+        self.assertEqual(None, get(9).get_next_sibling())
+
+        self.assertEqual(None, get(1).get_previous_sibling())
+        self.assertEqual(get(12), get(1).get_next_sibling())
+        self.assertEqual(get(1), get(12).get_previous_sibling())
+
+    def test_load_subtree(self):
+        """
+        Fill the children of a whole branch with one query
+
+        .. code::
+
+            level           Nested sets example
+                1                    1(1)22
+                        _______________|___________________
+                       |               |                   |
+                2    2(2)5           6(4)11             12(7)21
+                       |               ^                   ^
+                3    3(3)4       7(5)8   9(6)10    13(8)16   17(10)20
+                                                      |          |
+                4                                  14(9)15   18(11)19
+
+        """
+        node7 = (
+            self.session.query(self.model)
+            .filter(self.model.get_pk_column() == 7)
+            .one()
+        )
+
+        self.start_query_counter()
+        descendants = node7.load_subtree()
+
+        def walk(node):
+            return [
+                (child.get_pk_value(), child.parent.get_pk_value(),
+                 walk(child))
+                for child in node.children
+            ]
+
+        tree = walk(node7)
+        self.stop_query_counter()
+        self.assertEqual(1, len(self.stmts))
+        self.assertEqual(
+            [8, 9, 10, 11],
+            [node.get_pk_value() for node in descendants]
+        )
+        self.assertEqual(tree, [
+            (8, 7, [(9, 8, [])]),
+            (10, 7, [(11, 10, [])]),
+        ])
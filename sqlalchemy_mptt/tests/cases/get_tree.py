@@ -1,3 +1,5 @@
+from unittest import mock
+
 from sqlalchemy import asc
 
 
@@ -64,6 +66,44 @@ class Tree(object):
 
         self.assertEqual(tree, reference_tree)
 
+    def test_get_tree_preorder(self):
+        """ Nest the nodes read in ``(tree_id, lft)`` order with a stack
+
+        .. code::
+
+            tree = Tree.get_tree(self.session, preorder=True)
+        """
+        self.assertEqual(
+            self.model.get_tree(self.session, preorder=True),
+            self.model.get_tree(self.session)
+        )
+        self.assertEqual(
+            self.model.get_tree(self.session, json=True, preorder=True),
+            self.model.get_tree(self.session, json=True)
+        )
+        self.assertEqual(
+            self.model.get_tree(self.session, columns=['visible'],
+                                preorder=True),
+            self.model.get_tree(self.session, columns=['visible'])
+        )
+
+        # the children of a node left out go to its parent
+        def query(nodes):
+            return nodes.filter(
+                self.model.tree_id == 1,
+                self.model.get_pk_column() != 7
+            )
+
+        tree = self.model.get_tree(self.session, query=query, preorder=True,
+                                   columns=[])
+        self.assertEqual(tree, [
+            {'id': 1, 'children': [
+                {'id': 2, 'children': [{'id': 3}]},
+                {'id': 4, 'children': [{'id': 5}, {'id': 6}]},
+                {'id': 8, 'children': [{'id': 9}]},
+                {'id': 10, 'children': [{'id': 11}]}]}
+        ])
+
     def test_get_tree_count_query(self):
         """
         Count num of queries to the database.
@@ -182,6 +222,60 @@ class Tree(object):
         tree = self.model.get_tree(self.session, json=True, json_fields=fields)
         self.assertEqual(tree, reference_tree)
 
+    def test_get_json_tree_from_columns(self):
+        """ Build the JSON tree from plain rows of the chosen columns
+
+        .. code::
+
+            tree = Tree.get_tree(self.session, columns=['visible'])
+        """
+        def query(nodes):
+            return nodes.filter(self.model.tree_id == 1)
+
+        reference_tree = [
+            {'id': 1, 'visible': None, 'children': [
+                {'id': 2, 'visible': True, 'children': [
+                    {'id': 3, 'visible': True}]},
+                {'id': 4, 'visible': True, 'children': [
+                    {'id': 5, 'visible': True},
+                    {'id': 6, 'visible': True}]},
+                {'id': 7, 'visible': True, 'children': [
+                    {'id': 8, 'visible': True, 'children': [
+                        {'id': 9, 'visible': None}]},
+                    {'id': 10, 'visible': None, 'children': [
+                        {'id': 11, 'visible': None}]}]}]}]
+
+        self.start_query_counter()
+        tree = self.model.get_tree(self.session, query=query,
+                                   columns=['visible'])
+        self.stop_query_counter()
+        self.assertEqual(tree, reference_tree)
+        self.assertEqual(len(self.stmts), 1)
+        self.assertEqual(len(self.session.identity_map), 0)
+
+        tree = self.model.get_tree(
+            self.session, query=query,
+            columns=[self.model.tree_id.label('label')]
+        )
+        self.assertEqual(tree[0]['label'], 1)
+        self.assertEqual(tree[0]['children'][0], {
+            'id': 2, 'label': 1, 'children': [{'id': 3, 'label': 1}]
+        })
+
+    def test_get_json_tree_from_columns_of_base_query(self):
+        """ The rows of the chosen columns come from ``_base_query``, as the
+        nodes do
+        """
+        def base_query(cls, session=None):
+            return session.query(cls).filter(cls.tree_id == 2)
+
+        with mock.patch.object(self.model, '_base_query',
+                               classmethod(base_query)):
+            tree = self.model.get_tree(self.session, columns=['tree_id'])
+        self.assertEqual(
+            [(12, 2)], [(node['id'], node['tree_id']) for node in tree]
+        )
+
     def test_leftsibling_in_level(self):
         """ Node to the left of the current node at the same level
 
@@ -267,6 +361,48 @@ class Tree(object):
         ]
         self.assertEqual(tree, reference_tree)
 
+    def test_iter_tree(self):
+        def query(nodes):
+            return nodes.filter(self.model.tree_id == 1)
+
+        events = [
+            (event, node.get_pk_value())
+            for event, node in self.model.iter_tree(
+                self.session, query=query, yield_per=2
+            )
+        ]
+        self.assertEqual(
+            events,
+            [('enter', 1),
+             ('enter', 2), ('enter', 3), ('leave', 3), ('leave', 2),
+             ('enter', 4),
+             ('enter', 5), ('leave', 5), ('enter', 6), ('leave', 6),
+             ('leave', 4),
+             ('enter', 7),
+             ('enter', 8), ('enter', 9), ('leave', 9), ('leave', 8),
+             ('enter', 10), ('enter', 11), ('leave', 11), ('leave', 10),
+             ('leave', 7),
+             ('leave', 1)]
+        )
+
+    def test_iter_tree_between_trees(self):
+        level = self.model.get_default_level() + 1
+
+        def query(nodes):
+            return nodes.filter(self.model.level == level)
+
+        events = [
+            (event, node.get_pk_value())
+            for event, node in self.model.iter_tree(self.session, query=query)
+        ]
+        self.assertEqual(
+            events,
+            [('enter', 2), ('leave', 2), ('enter', 4), ('leave', 4),
+             ('enter', 7), ('leave', 7),
+             ('enter', 13), ('leave', 13), ('enter', 15), ('leave', 15),
+             ('enter', 18), ('leave', 18)]
+        )
+
     def test_drilldown_tree_without_session(self):
         def go(id):
             return get_obj(self.session, self.model, id)
@@ -7,6 +7,8 @@
 # Distributed under terms of the MIT license.
 import os
 
+from sqlalchemy import inspect
+
 
 class MoveBefore(object):
 
@@ -769,6 +771,11 @@ class MoveAfter(object):
             .filter(self.model.get_pk_column() == 7).one()
         node.parent_id = None
         self.session.add(node)
+        self.start_query_counter()
+        self.session.flush()
+        self.stop_query_counter()
+        # the moved subtree is found by its keys, not by a list of its ids
+        self.assertFalse([stmt for stmt in self.stmts if ' IN (' in stmt])
         _level = node.get_default_level()
         self.assertEqual(
             [
@@ -898,6 +905,11 @@ class MoveInside(object):
             .filter(self.model.get_pk_column() == 4).one()
         node.parent_id = 15
         self.session.add(node)
+        self.start_query_counter()
+        self.session.flush()
+        self.stop_query_counter()
+        # the moved subtree is found by its keys, not by a list of its ids
+        self.assertFalse([stmt for stmt in self.stmts if ' IN (' in stmt])
         _level = node.get_default_level()
         self.assertEqual(
             [
@@ -1179,3 +1191,131 @@ class MoveInside(object):
             ],
             self.result.all()
         )
+
+    def test_move_in_the_same_tree_with_one_update(self):
+        """ For example move node(10) inside node(7), then node(2) after node(4)
+
+        initial state of the tree :mod:`sqlalchemy_mptt.tests.add_mptt_tree`
+
+        .. code::
+
+            level               Initial state
+                1                    1(1)22
+                        _______________|___________________
+                       |               |                   |
+                2    2(2)5           6(4)11             12(7)21
+                       |               ^                   ^
+                3    3(3)4       7(5)8   9(6)10    13(8)16   17(10)20
+                                                      |          |
+                4                                  14(9)15   18(11)19
+
+            level      move 10 inside 7 and 2 after 4
+                1                    1(1)22
+                        _______________|___________________
+                       |               |                   |
+                2    2(4)7           8(2)11             12(7)21
+                       ^               |                   ^
+                3  3(5)4  5(6)6      9(3)10    13(10)16   17(8)20
+                                                  |          |
+                4                              14(11)15   18(9)19
+
+        """
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 10).one()
+        node.move_inside("7")
+        self.start_query_counter()
+        self.session.flush()
+        self.stop_query_counter()
+        # only the keys of the tree, the ORM may update the node row itself
+        moves = [stmt for stmt in self.stmts if 'CASE' in stmt]
+        self.assertEqual(1, len(moves))
+        # MySQL assigns from left to right, the level is computed from the
+        # keys before they change
+        self.assertIn('SET level=CASE', moves[0])
+
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 2).one()
+        node.move_after("4")
+        self.start_query_counter()
+        self.session.flush()
+        self.stop_query_counter()
+        # only the keys of the tree, the ORM may update the node row itself
+        self.assertEqual(
+            1, len([stmt for stmt in self.stmts if 'CASE' in stmt])
+        )
+
+        _level = node.get_default_level()
+        self.assertEqual(
+            [
+                # id lft rgt lvl parent tree
+                (1,   1, 22, _level + 0, None, 1),
+                (2,   8, 11, _level + 1,  1, 1),
+                (3,   9, 10, _level + 2,  2, 1),
+                (4,   2,  7, _level + 1,  1, 1),
+                (5,   3,  4, _level + 2,  4, 1),
+                (6,   5,  6, _level + 2,  4, 1),
+                (7,  12, 21, _level + 1,  1, 1),
+                (8,  17, 20, _level + 2,  7, 1),
+                (9,  18, 19, _level + 3,  8, 1),
+                (10, 13, 16, _level + 2,  7, 1),
+                (11, 14, 15, _level + 3, 10, 1),
+
+                (12,  1, 22, _level + 0, None, 2),
+                (13,  2,  5, _level + 1, 12, 2),
+                (14,  3,  4, _level + 2, 13, 2),
+                (15,  6, 11, _level + 1, 12, 2),
+                (16,  7,  8, _level + 2, 15, 2),
+                (17,  9, 10, _level + 2, 15, 2),
+                (18, 12, 21, _level + 1, 12, 2),
+                (19, 13, 16, _level + 2, 18, 2),
+                (20, 14, 15, _level + 3, 19, 2),
+                (21, 17, 20, _level + 2, 18, 2),
+                (22, 18, 19, _level + 3, 21, 2)
+            ],
+            self.result.all()
+        )
+
+    def test_move_inside_descendant(self):
+        """ Moving node(7) inside its child node(10) would make a cycle
+        """
+        node = self.session.query(self.model)\
+            .filter(self.model.get_pk_column() == 7).one()
+        node.move_inside("10")
+        self.assertRaises(ValueError, self.session.flush)
+        self.session.rollback()
+
+    def test_move_patches_loaded_nodes(self):
+        """ After a flush the keys of the loaded nodes are shifted in memory
+        like in the table, only the moved node is expired and ``children``
+        is never loaded
+        """
+        nodes = self.session.query(self.model).all()
+        node = [node for node in nodes if node.get_pk_value() == 10][0]
+        node.move_inside(4)
+        self.start_query_counter()
+        self.session.flush()
+        self.stop_query_counter()
+        self.assertEqual(
+            2, len([stmt for stmt in self.stmts if stmt.startswith('SELECT')])
+        )
+
+        expired = [
+            node.get_pk_value() for node in nodes
+            if 'left' not in inspect(node).dict
+        ]
+        self.assertEqual([10], expired)
+        self.start_query_counter()
+        values = sorted(
+            (node.get_pk_value(), node.left, node.right, node.level,
+             node.parent_id, node.tree_id)
+            for node in nodes if node.get_pk_value() != 10
+        )
+        self.stop_query_counter()
+        self.assertEqual([], self.stmts)
+        self.assertEqual(
+            sorted(values + [
+                (10, node.left, node.right, node.level, node.parent_id,
+                 node.tree_id)
+            ]),
+            self.result.order_by(self.model.get_pk_column()).all()
+        )
@@ -10,14 +10,20 @@
 test tree
 """
 
+import os
+import shutil
+import tempfile
 import unittest
 
-from sqlalchemy import Column, Boolean, Integer, create_engine
+from sqlalchemy import (Column, Boolean, Integer, Sequence, create_engine,
+                        event)
 from sqlalchemy.event import contains
 from sqlalchemy.orm import sessionmaker
 
 from sqlalchemy_mptt import mptt_sessionmaker
 
+from sqlalchemy_mptt.allocators import (CounterTreeIdAllocator,
+                                        SequenceTreeIdAllocator)
 from sqlalchemy_mptt.mixins import BaseNestedSets
 from sqlalchemy_mptt.sqlalchemy_compat import compat_layer
 from sqlalchemy_mptt.tests import TreeTestingMixin
@@ -60,6 +66,29 @@ class TreeWithCustomLevel(Base, BaseNestedSets):
         return "<Node (%s)>" % self.id
 
 
+class TreeWithGap(Base, BaseNestedSets):
+    __tablename__ = "tree_with_gap"
+
+    id = Column(Integer, primary_key=True)
+    visible = Column(Boolean)
+
+    sqlalchemy_mptt_gap = 9
+
+    def __repr__(self):
+        return "<Node (%s)>" % self.id
+
+
+class TreeWithCounter(Base, BaseNestedSets):
+    __tablename__ = "tree_with_counter"
+
+    id = Column(Integer, primary_key=True)
+
+    sqlalchemy_mptt_tree_id_allocator = CounterTreeIdAllocator(Base.metadata)
+
+    def __repr__(self):
+        return "<Node (%s)>" % self.id
+
+
 class TestTree(TreeTestingMixin, unittest.TestCase):
     base = Base
     model = Tree
@@ -75,6 +104,273 @@ class TestTreeWithCustomLevel(TreeTestingMixin, unittest.TestCase):
     model = TreeWithCustomLevel
 
 
+class TestTreeWithGap(unittest.TestCase):
+    """Sparse numbering leaves room between the keys of the nodes"""
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Session = mptt_sessionmaker(sessionmaker(bind=self.engine))
+        self.session = Session()
+        Base.metadata.create_all(self.engine)
+        self.stmts = []
+        event.listen(self.engine, 'before_cursor_execute', self.catch_queries)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self.catch_queries)
+        Base.metadata.drop_all(self.engine)
+
+    def catch_queries(self, conn, cursor, statement, *args):
+        self.stmts.append(statement)
+
+    def add(self, **kwargs):
+        node = TreeWithGap(**kwargs)
+        self.session.add(node)
+        self.session.flush()
+        return node
+
+    def assertNested(self):
+        """Every node lies strictly inside its parent, siblings never overlap
+        """
+        nodes = self.session.query(TreeWithGap).all()
+        for node in nodes:
+            self.session.refresh(node)
+        for node in nodes:
+            self.assertLess(node.left, node.right)
+            for other in nodes:
+                if other.parent_id == node.id:
+                    self.assertTrue(node.is_ancestor_of(other))
+                elif node is not other and other.tree_id == node.tree_id:
+                    self.assertTrue(
+                        other.right < node.left or node.right < other.left
+                        or node.is_ancestor_of(other)
+                        or other.is_ancestor_of(node)
+                    )
+
+    def test_insert_without_shift(self):
+        root = self.add()
+        self.assertEqual((root.left, root.right), (1, 10))
+        child = self.add(parent_id=root.id)
+        self.assertEqual((child.left, child.right), (4, 7))
+
+        del self.stmts[:]
+        grandchild = self.add(parent_id=child.id)
+        self.assertFalse(
+            [stmt for stmt in self.stmts if stmt.startswith('UPDATE')]
+        )
+        self.assertEqual((grandchild.left, grandchild.right), (5, 6))
+        self.assertTrue(root.is_ancestor_of(grandchild))
+        self.assertNested()
+
+    def test_insert_when_gap_runs_out(self):
+        root = self.add()
+        children = [self.add(parent_id=root.id) for _ in range(6)]
+        self.assertNested()
+        self.session.expire_all()
+        self.assertGreater(root.right, children[-1].right)
+        self.assertEqual(
+            sorted(children, key=lambda node: node.left),
+            children
+        )
+
+    def test_delete_keeps_hole(self):
+        root = self.add()
+        first = self.add(parent_id=root.id)
+        second = self.add(parent_id=root.id)
+        self.session.expire_all()
+        right = second.right
+
+        self.session.delete(first)
+        self.session.flush()
+        self.session.expire_all()
+        self.assertEqual(second.right, right)
+
+        third = self.add(parent_id=root.id)
+        self.assertGreater(third.left, second.right)
+        self.assertNested()
+
+    def test_delete_subtree_keeps_hole(self):
+        root = self.add()
+        first = self.add(parent_id=root.id)
+        self.add(parent_id=first.id)
+        second = self.add(parent_id=root.id)
+        self.session.expire_all()
+        right = second.right
+
+        del self.stmts[:]
+        first.delete_subtree()
+        self.assertFalse(
+            [stmt for stmt in self.stmts if stmt.startswith('UPDATE')]
+        )
+        self.assertEqual(second.right, right)
+        self.assertEqual(self.session.query(TreeWithGap).count(), 2)
+        self.assertNested()
+
+    def test_move(self):
+        root = self.add()
+        first = self.add(parent_id=root.id)
+        second = self.add(parent_id=root.id)
+        self.add(parent_id=second.id)
+
+        second.move_inside(first.id)
+        self.session.flush()
+        self.assertNested()
+
+        self.session.expire_all()
+        second.move_after(first.id)
+        self.session.flush()
+        self.assertNested()
+        self.assertEqual(
+            [node.id for node in root.children], [first.id, second.id]
+        )
+
+
+class TestCounterTreeIdAllocator(unittest.TestCase):
+    """Tree ids of new trees come from a counter row, not from MAX(tree_id)
+    """
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Session = mptt_sessionmaker(sessionmaker(bind=self.engine))
+        self.session = Session()
+        Base.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        Base.metadata.drop_all(self.engine)
+
+    def test_allocate(self):
+        first = TreeWithCounter()
+        second = TreeWithCounter()
+        self.session.add_all([first, second])
+        self.session.flush()
+        self.assertEqual((first.tree_id, second.tree_id), (1, 2))
+
+        stmts = []
+        catch = lambda conn, cursor, statement, *args: stmts.append(statement)  # noqa
+        event.listen(self.engine, 'before_cursor_execute', catch)
+        third = TreeWithCounter()
+        self.session.add(third)
+        self.session.flush()
+        event.remove(self.engine, 'before_cursor_execute', catch)
+        self.assertEqual(third.tree_id, 3)
+        self.assertFalse([stmt for stmt in stmts if 'max(' in stmt])
+
+    def test_allocate_after_move_to_top_level(self):
+        first = TreeWithCounter()
+        child = TreeWithCounter(parent=first)
+        self.session.add(first)
+        self.session.flush()
+
+        child.move_before(first.id)
+        self.session.flush()
+        self.session.expire_all()
+        self.assertEqual((child.tree_id, first.tree_id), (1, 2))
+
+        second = TreeWithCounter()
+        self.session.add(second)
+        self.session.flush()
+        self.assertEqual(second.tree_id, 3)
+
+    def test_bulk_insert_tree(self):
+        self.session.add(TreeWithCounter())
+        self.session.flush()
+        TreeWithCounter.bulk_insert_tree(self.session, [{}, {}])
+        self.assertEqual(
+            [2, 3],
+            [tree_id for tree_id, in self.session.query(
+                TreeWithCounter.tree_id).filter(TreeWithCounter.tree_id > 1)]
+        )
+
+    def test_allocate_after_concurrent_counter_creation(self):
+        """ The counter row created by another transaction between the
+        UPDATE and the INSERT of the first allocation is incremented
+        """
+        class RacingAllocator(CounterTreeIdAllocator):
+            raced = False
+
+            def _increment(self, connection, table, count):
+                if self.raced:
+                    return super(RacingAllocator, self)._increment(
+                        connection, table, count)
+                self.raced = True
+                connection.execute(self.table.insert().values(
+                    tree_table=table.name, value=5))
+                return 0
+
+        allocator = RacingAllocator(Base.metadata)
+        connection = self.session.connection()
+        self.assertEqual(
+            [6, 7],
+            allocator.allocate_many(connection, TreeWithCounter.__table__, 2)
+        )
+
+
+class TestSequenceTreeIdAllocator(unittest.TestCase):
+    """Tree ids of new trees come from a sequence, in blocks"""
+
+    class Connection(object):
+        """Sequence incrementing by 10"""
+
+        def __init__(self):
+            self.reads = 0
+
+        def scalar(self, statement):
+            self.reads += 1
+            return self.reads * 10 - 9
+
+    def test_allocate_in_blocks(self):
+        allocator = SequenceTreeIdAllocator(
+            Sequence("tree_id_seq", increment=10), block_size=10
+        )
+        connection = self.Connection()
+        self.assertEqual([1, 2, 3], allocator.allocate_many(
+            connection, Tree.__table__, 3))
+        self.assertEqual(4, allocator.allocate(connection, Tree.__table__))
+        self.assertEqual(1, connection.reads)
+        self.assertEqual(list(range(5, 16)), allocator.allocate_many(
+            connection, Tree.__table__, 11))
+        self.assertEqual(2, connection.reads)
+
+
+class TestParallelRebuild(unittest.TestCase):
+    """Trees are rebuilt by a pool of workers with their own connections"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_engine(
+            'sqlite:///' + os.path.join(self.directory, 'tree.db')
+        )
+        Session = mptt_sessionmaker(sessionmaker(bind=self.engine))
+        self.session = Session()
+        Base.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_rebuild_with_workers(self):
+        roots = [Tree() for _ in range(4)]
+        for root in roots:
+            child = Tree(parent=root)
+            Tree(parent=child)
+            Tree(parent=root)
+        self.session.add_all(roots)
+        self.session.commit()
+        expected = sorted(self.session.query(
+            Tree.id, Tree.left, Tree.right, Tree.level, Tree.tree_id))
+        self.session.query(Tree).update(
+            {Tree.left: 0, Tree.right: 0, Tree.level: 0}
+        )
+        self.session.commit()
+
+        timings = Tree.rebuild(self.session, workers=2)
+        self.assertEqual(sorted(timings), [1, 2, 3, 4])
+        self.assertEqual(expected, sorted(self.session.query(
+            Tree.id, Tree.left, Tree.right, Tree.level, Tree.tree_id)))
+        self.assertEqual(roots[0].right, 8)
+
+
 class Events(unittest.TestCase):
 
     def test_register(self):
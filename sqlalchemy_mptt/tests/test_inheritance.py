@@ -5,7 +5,7 @@ from sqlalchemy.orm import sessionmaker
 
 from sqlalchemy_mptt.mixins import BaseNestedSets
 from sqlalchemy_mptt.sqlalchemy_compat import compat_layer
-from sqlalchemy_mptt.tests import TreeTestingMixin, failures_expected_on
+from sqlalchemy_mptt.tests import TreeTestingMixin
 
 
 Base = compat_layer.declarative_base()
@@ -150,7 +150,3 @@ class InheritanceTree(BaseInheritance, BaseNestedSets):
 class TestInheritanceTree(TreeTestingMixin, unittest.TestCase):
     base = Base2
     model = InheritanceTree
-
-    @failures_expected_on(sqlalchemy_versions=['1.0', '1.1', '1.2', '1.3'])
-    def test_rebuild(self):
-        super().test_rebuild()
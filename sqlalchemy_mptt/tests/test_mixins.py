@@ -12,6 +12,8 @@ test tree
 import unittest
 
 from sqlalchemy import Column, Integer
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
 
 from sqlalchemy_mptt.mixins import BaseNestedSets
 from sqlalchemy_mptt.sqlalchemy_compat import compat_layer
@@ -32,3 +34,46 @@ class TestMixin(unittest.TestCase):
             Tree2.parent_id.__class__.__name__,
             'InstrumentedAttribute'
         )
+
+    def test_mixin_indexes(self):
+        self.assertEqual(
+            set(
+                tuple(column.name for column in index.columns)
+                for index in Tree2.__table__.indexes
+                if len(index.columns) > 1
+            ),
+            set([
+                ('tree_id', 'lft'),
+                ('tree_id', 'rgt'),
+                ('tree_id', 'level', 'lft'),
+                ('parent_id', 'lft'),
+            ])
+        )
+
+    def test_mixin_indexes_opt_out(self):
+        class Tree3(Base, BaseNestedSets):
+            __tablename__ = "tree3"
+
+            id = Column(Integer, primary_key=True)
+
+            sqlalchemy_mptt_indexes = ()
+
+        self.assertFalse([
+            index for index in Tree3.__table__.indexes
+            if len(index.columns) > 1
+        ])
+
+    def test_mixin_indexes_long_table_name(self):
+        class Tree4(Base, BaseNestedSets):
+            __tablename__ = "product_catalogue_category_hierarchy_nodes_v2"
+
+            id = Column(Integer, primary_key=True)
+
+        dialect = postgresql.dialect()
+        names = set()
+        for index in Tree4.__table__.indexes:
+            statement = str(CreateIndex(index).compile(dialect=dialect))
+            name = statement.split()[2]
+            self.assertLessEqual(len(name), dialect.max_identifier_length)
+            names.add(name)
+        self.assertEqual(len(names), len(Tree4.__table__.indexes))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Distributed under terms of the MIT license.
+
+"""
+test numbering of adjacency lists
+"""
+import unittest
+
+from sqlalchemy_mptt import numbering
+from sqlalchemy_mptt.numbering import number_tree
+
+# Nodes of tree 1 of the fixtures, listed out of order
+IDS = [7, 1, 10, 2, 11, 3, 8, 4, 9, 5, 6]
+PARENT_IDS = [1, None, 7, 1, 10, 2, 7, 1, 8, 4, 4]
+NUMBERED = {
+    # id lft rgt lvl
+    1: (1, 22, 1),
+    2: (2, 5, 2),
+    3: (3, 4, 3),
+    4: (6, 11, 2),
+    5: (7, 8, 3),
+    6: (9, 10, 3),
+    7: (12, 21, 2),
+    8: (13, 16, 3),
+    9: (14, 15, 4),
+    10: (17, 20, 3),
+    11: (18, 19, 4),
+}
+
+
+class NumberTreePython(unittest.TestCase):
+    vectorized = False
+
+    def number(self, *args, **kwargs):
+        return number_tree(*args, vectorized=self.vectorized, **kwargs)
+
+    def test_number_tree(self):
+        lefts, rights, levels = self.number(IDS, PARENT_IDS, order_keys=IDS)
+        self.assertEqual(
+            NUMBERED,
+            dict(zip(IDS, zip(lefts, rights, levels)))
+        )
+
+    def test_siblings_in_input_order(self):
+        self.assertEqual(
+            ([1, 2, 4], [6, 3, 5], [0, 1, 1]),
+            self.number([1, 3, 2], [None, 1, 1], level=0)
+        )
+
+    def test_forest(self):
+        self.assertEqual(
+            ([1, 2, 1, 2], [4, 3, 4, 3], [1, 2, 1, 2]),
+            self.number(['a', 'b', 'c', 'd'], [None, 'a', None, 'c'])
+        )
+
+    def test_orphan(self):
+        self.assertRaises(
+            ValueError, self.number, ['a', 'b', 'c'], [None, 'a', 'x']
+        )
+
+    def test_cycle(self):
+        self.assertRaises(ValueError, self.number, [1, 2, 3], [None, 3, 2])
+
+
+@unittest.skipIf(numbering.numpy is None, "NumPy is not installed")
+class NumberTreeNumpy(NumberTreePython):
+    vectorized = True